@@ -0,0 +1,448 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+##
+# run.py: Measures how fast the simulators and protocols in each chapter
+#     run, writes the results as JSON, and compares them against a stored
+#     baseline to flag regressions.
+#
+# Usage:
+#     python benchmarks/run.py --save-baseline   # record baseline.json on
+#                                                # this machine
+#     python benchmarks/run.py                   # run everything, compare
+#                                                # against baseline.json
+#     python benchmarks/run.py --suite ch06 --sizes 1 2 4 8
+#     python benchmarks/run.py --output results.json
+##
+# Copyright (c) Sarah Kaiser and Cassandra Granade.
+# Code sample from the book "Learn Quantum Computing with Python and Q#" by
+# Sarah Kaiser and Cassandra Granade, published by Manning Publications Co.
+# Book ISBN 9781617296130.
+# Code licensed under the MIT License.
+##
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from functools import partial
+from typing import Callable, Dict, Iterator, List, NamedTuple, Sequence
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_SIZES = [1, 2, 4, 8, 12, 16, 20]
+
+# Number of timings taken of each benchmark once the number of calls per
+# timing has been settled.
+REPEAT = 5
+
+class Result(NamedTuple):
+    name: str
+    value: float
+    unit: str
+    higher_is_better: bool = True
+    # How much the timings of this result varied, as a fraction of
+    # `value`; see _combine_rounds.
+    noise: float = 0.0
+
+class Rate(NamedTuple):
+    value: float
+    noise: float
+
+def _time(fn: Callable[[], None], n_loops: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n_loops):
+        fn()
+    return time.perf_counter() - start
+
+def _rate(fn: Callable[[], None], min_time: float, repeat: int = REPEAT,
+          ops_per_call: float = 1) -> Rate:
+    # As with timeit, double the number of calls until one timing takes at
+    # least min_time. Then take `repeat` timings and report the median,
+    # along with the median distance of a timing from it, so that a single
+    # lucky or unlucky timing moves neither.
+    n_loops = 1
+    while _time(fn, n_loops) < min_time:
+        n_loops *= 2
+    rates = [
+        n_loops * ops_per_call / _time(fn, n_loops) for _ in range(repeat)
+    ]
+    median = statistics.median(rates)
+    spread = statistics.median(abs(rate - median) for rate in rates)
+    return Rate(median, spread / median)
+
+def _result(name: str, rate: Rate, unit: str) -> Result:
+    return Result(name, rate.value, unit, noise=rate.noise)
+
+def _latency(name: str, rate: Rate) -> Result:
+    # The time per call, in seconds, with the same relative noise as the
+    # rate it comes from.
+    return Result(name, 1 / rate.value, "s", higher_is_better=False,
+                  noise=rate.noise)
+
+@contextlib.contextmanager
+def _quiet() -> Iterator[None]:
+    # Several of the samples print as they go; keep that out of the JSON.
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+## Suites #####################################################################
+# Each suite runs in its own process with its chapter's directory first on
+# sys.path, since every chapter has its own simulator.py and interface.py.
+
+def suite_ch02(sizes: Sequence[int], min_time: float) -> Iterator[Result]:
+    from simulator import SingleQubitSimulator
+    from qrng import qrng, qrng_shots
+    from qrng_stream import QrngStream
+
+    device = SingleQubitSimulator()
+    yield _result("ch02.qrng.bytes", _rate(
+        partial(qrng, device), min_time, ops_per_call=1 / 8
+    ), "bytes/s")
+    yield _result("ch02.qrng_shots.bytes", _rate(
+        partial(qrng_shots, device, 8 * 4096), min_time, ops_per_call=4096
+    ), "bytes/s")
+    stream = QrngStream(buffer_size=1 << 16)
+    yield _result("ch02.qrng_stream.bytes", _rate(
+        partial(stream.read, 1 << 20), min_time, ops_per_call=1 << 20
+    ), "bytes/s")
+
+def suite_ch03(sizes: Sequence[int], min_time: float) -> Iterator[Result]:
+    import bb84
+    import bb84_bulk
+
+    with _quiet():
+        yield _result("ch03.bb84.key_bits", _rate(
+            partial(bb84.simulate_bb84, 64), min_time, ops_per_call=64
+        ), "bits/s")
+        yield _result("ch03.bb84_bulk.key_bits", _rate(
+            partial(bb84_bulk.simulate_bb84, 1 << 20), min_time,
+            ops_per_call=1 << 20
+        ), "bits/s")
+
+def suite_ch05(sizes: Sequence[int], min_time: float) -> Iterator[Result]:
+    import qutip as qt
+    import chsh
+
+    n_games = 100
+    for name, strategy in [
+        ("constant", chsh.constant_strategy),
+        ("quantum", partial(chsh.quantum_strategy, qt.bell_state()))
+    ]:
+        yield _result(f"ch05.chsh.{name}.games", _rate(
+            partial(chsh.est_win_probability, strategy, n_games), min_time,
+            ops_per_call=n_games
+        ), "games/s")
+
+    n_games = 1_000_000
+    compiled = chsh.compile_quantum_strategy(qt.bell_state())
+    yield _result("ch05.chsh.compiled.games", _rate(
+        partial(compiled.play, n_games), min_time, ops_per_call=n_games
+    ), "games/s")
+
+def suite_ch06(sizes: Sequence[int], min_time: float) -> Iterator[Result]:
+    from simulator import Simulator
+    from stabilizer import StabilizerSimulator, run_program
+    from mps import MPSSimulator
+    from noise import (
+        DensityMatrixSimulator, NoiseModel, TrajectorySimulator, depolarizing
+    )
+    from batched import BatchedSimulator, quantum_strategy, referee
+    from teleport import teleport
+
+    noise_model = NoiseModel(after_gate={
+        gate: [depolarizing(0.01)] for gate in ("h", "x", "cnot")
+    })
+    # Each backend, with the largest register it can reasonably hold.
+    backends = {
+        "dense": (partial(Simulator, backend="dense"), 20),
+        "sparse": (partial(Simulator, backend="sparse"), 20),
+        "stabilizer": (StabilizerSimulator, 20),
+        "mps": (MPSSimulator, 20),
+        "density": (DensityMatrixSimulator, 10),
+        "trajectory": (
+            partial(TrajectorySimulator, noise_model=noise_model), 20
+        )
+    }
+    angle = 0.123
+    single_qubit_gates = {
+        "h": lambda q: q.h(),
+        "x": lambda q: q.x(),
+        "y": lambda q: q.y(),
+        "z": lambda q: q.z(),
+        "rx": lambda q: q.rx(angle),
+        "ry": lambda q: q.ry(angle),
+        "rz": lambda q: q.rz(angle)
+    }
+    two_qubit_gates = {
+        "cnot": lambda q, r: q.cnot(r),
+        "swap": lambda q, r: q.swap(r)
+    }
+
+    for backend, (factory, max_qubits) in backends.items():
+        for n_qubits in sizes:
+            if n_qubits > max_qubits:
+                continue
+            sim = factory(n_qubits)
+            qubits = [sim.allocate_qubit() for _ in range(n_qubits)]
+            # Start from a superposition, so that no backend can take a
+            # shortcut for qubits it knows to be in |0⟩.
+            for qubit in qubits:
+                qubit.h()
+
+            for gate, apply in single_qubit_gates.items():
+                if backend == "stabilizer" and gate.startswith("r"):
+                    continue
+                yield _result(
+                    f"ch06.gate.{gate}[{backend},n={n_qubits}]",
+                    _rate(partial(apply, qubits[0]), min_time), "gates/s"
+                )
+            if n_qubits >= 2:
+                for gate, apply in two_qubit_gates.items():
+                    yield _result(
+                        f"ch06.gate.{gate}[{backend},n={n_qubits}]",
+                        _rate(partial(apply, qubits[0], qubits[-1]), min_time),
+                        "gates/s"
+                    )
+
+            def measure_once():
+                # Rotate back into superposition first, as measuring a
+                # qubit twice in a row can be answered without simulation.
+                qubits[0].h()
+                qubits[0].measure()
+            yield _latency(
+                f"ch06.measure[{backend},n={n_qubits}]",
+                _rate(measure_once, min_time)
+            )
+
+        sim = factory(3)
+        def teleport_once():
+            with sim.using_register(3) as (msg, here, there):
+                msg.h()
+                teleport(msg, here, there)
+        yield _result(
+            f"ch06.teleport[{backend}]", _rate(teleport_once, min_time),
+            "teleports/s"
+        )
+
+    # Devices that change how a program is run, rather than how the state
+    # is stored.
+    for n_qubits in sizes:
+        if n_qubits > 20:
+            continue
+        # A dynamic register only holds the qubits that are in use, so an
+        # ancilla borrowed from a large, mostly idle device stays cheap.
+        sim = Simulator(n_qubits, dynamic=True)
+        def ancilla_once():
+            with sim.using_qubit() as ancilla:
+                ancilla.h()
+                ancilla.measure()
+        yield _latency(
+            f"ch06.ancilla[dynamic,n={n_qubits}]",
+            _rate(ancilla_once, min_time)
+        )
+
+        # A GHZ state is all Clifford gates; the final rotation makes the
+        # device switch to a state vector for the measurements.
+        def ghz_then_rotate(device):
+            with device.using_register(n_qubits) as qubits:
+                qubits[0].h()
+                for target in qubits[1:]:
+                    qubits[0].cnot(target)
+                qubits[0].rx(angle)
+                return [qubit.measure() for qubit in qubits]
+        yield _result(
+            f"ch06.ghz_then_rotate[clifford_first,n={n_qubits}]",
+            _rate(partial(run_program, ghz_then_rotate, n_qubits), min_time),
+            "programs/s"
+        )
+
+    n_games = 10_000
+    sim = BatchedSimulator(n_games, capacity=2)
+    yield _result("ch06.chsh.batched.games", _rate(
+        partial(referee, quantum_strategy, sim), min_time,
+        ops_per_call=n_games
+    ), "games/s")
+
+SUITES: Dict[str, Callable[[Sequence[int], float], Iterator[Result]]] = {
+    "ch02": suite_ch02,
+    "ch03": suite_ch03,
+    "ch05": suite_ch05,
+    "ch06": suite_ch06
+}
+
+## Running and comparing ######################################################
+
+def _combine_rounds(rounds: List[List[Result]]) -> List[Result]:
+    # Timings taken back to back agree far more closely than timings taken
+    # minutes apart, as the load on the machine and its clock speed drift.
+    # So each result is the median over rounds of the whole suite, and its
+    # noise the larger of the typical noise within a round and the median
+    # distance of a round from that median.
+    combined = []
+    for results in zip(*rounds):
+        values = [result.value for result in results]
+        median = statistics.median(values)
+        spread = statistics.median(abs(value - median) for value in values)
+        combined.append(results[0]._replace(
+            value=median,
+            noise=max(
+                spread / median,
+                statistics.median(result.noise for result in results)
+            )
+        ))
+    return combined
+
+def _run_worker(suite: str, sizes: Sequence[int], min_time: float,
+                rounds: int) -> None:
+    chapter_dir = os.path.join(ROOT, suite)
+    os.chdir(chapter_dir)
+    sys.path.insert(0, chapter_dir)
+    results = _combine_rounds([
+        list(SUITES[suite](sizes, min_time)) for _ in range(rounds)
+    ])
+    json.dump([result._asdict() for result in results], sys.stdout)
+
+def run_suite(suite: str, sizes: Sequence[int], min_time: float,
+              rounds: int) -> List[Result]:
+    completed = subprocess.run(
+        [
+            sys.executable, os.path.abspath(__file__), "--worker", suite,
+            "--sizes", *map(str, sizes), "--min-time", str(min_time),
+            "--rounds", str(rounds)
+        ],
+        stdout=subprocess.PIPE, check=True
+    )
+    return [Result(**result) for result in json.loads(completed.stdout)]
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict],
+            threshold: float, noise_factor: float = 3) -> List[str]:
+    """
+    Returns the names of results that are worse than the baseline by more
+    than their tolerance (as a fraction of the baseline), printing a line
+    to stderr for each result that has changed by more than that either
+    way.
+
+    The tolerance of each result is `threshold`, or `noise_factor` times
+    the combined noise of that result and its baseline if that is larger,
+    so that benchmarks whose timings jump around from run to run don't
+    count as regressions until they change by more than they vary.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result["value"] / baseline[name]["value"]
+        if not result["higher_is_better"]:
+            ratio = 1 / ratio
+        tolerance = max(threshold, noise_factor * (
+            result.get("noise", 0) + baseline[name].get("noise", 0)
+        ))
+        if ratio < 1 - tolerance:
+            regressions.append(name)
+            print(f"REGRESSION  {name}: {ratio:0.2f}x baseline (tolerance {tolerance:0.0%})", file=sys.stderr)
+        elif ratio > 1 + tolerance:
+            print(f"improvement {name}: {ratio:0.2f}x baseline (tolerance {tolerance:0.0%})", file=sys.stderr)
+    return regressions
+
+def _run_suites(suites: Sequence[str], sizes: Sequence[int],
+                min_time: float, rounds: int) -> Dict[str, dict]:
+    results = {}
+    for suite in suites:
+        print(f"Running {suite}...", file=sys.stderr)
+        for result in run_suite(suite, sizes, min_time, rounds):
+            print(f"    {result.name}: {result.value:0.4g} {result.unit}", file=sys.stderr)
+            results[result.name] = result._asdict()
+    return results
+
+def _better(result: dict, other: dict) -> dict:
+    if result["higher_is_better"]:
+        return max(result, other, key=lambda r: r["value"])
+    return min(result, other, key=lambda r: r["value"])
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the simulators and protocols in each chapter."
+    )
+    parser.add_argument("--suite", nargs="+", choices=sorted(SUITES), default=sorted(SUITES))
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES,
+                        help="Register sizes for the ch06 simulator benchmarks.")
+    parser.add_argument("--min-time", type=float, default=0.1,
+                        help="Minimum duration of each timing, in seconds.")
+    parser.add_argument("--rounds", type=int, default=3,
+                        help="Number of times to run each suite, taking the " \
+                             "median result of each benchmark.")
+    parser.add_argument("--output", default="-",
+                        help="Where to write results as JSON (default: stdout).")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Fractional slowdown that counts as a regression.")
+    parser.add_argument("--noise-factor", type=float, default=3,
+                        help="How many times its measured noise a result must " \
+                             "slow down by to count as a regression.")
+    parser.add_argument("--no-confirm", dest="confirm", action="store_false",
+                        help="Don't re-run suites with possible regressions before " \
+                             "reporting them.")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Write the results to the baseline instead of comparing.")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        _run_worker(args.worker, args.sizes, args.min_time, args.rounds)
+        return 0
+
+    results = _run_suites(args.suite, args.sizes, args.min_time, args.rounds)
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    if baseline is not None and args.confirm:
+        # A burst of other work on the machine can slow down a whole suite
+        # at once, so before reporting a regression, run its suite again
+        # and keep the better of the two results.
+        with contextlib.redirect_stderr(io.StringIO()):
+            suspects = compare(results, baseline, args.threshold, args.noise_factor)
+        if suspects:
+            suites = sorted({name.split(".")[0] for name in suspects})
+            print(f"Re-running {', '.join(suites)} to confirm {len(suspects)} possible regression(s)...", file=sys.stderr)
+            rerun = _run_suites(suites, args.sizes, args.min_time, args.rounds)
+            for name in suspects:
+                if name in rerun:
+                    results[name] = _better(results[name], rerun[name])
+
+    report = {
+        "machine": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor()
+        },
+        "results": results
+    }
+
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        return 0
+    if baseline is None:
+        print(f"No baseline at {args.baseline}; record one with --save-baseline.", file=sys.stderr)
+        return 0
+    regressions = compare(results, baseline, args.threshold, args.noise_factor)
+    print(f"{len(regressions)} regression(s) against {args.baseline}.", file=sys.stderr)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,12 +13,18 @@
 
 from interface import QuantumDevice
 from simulator import SingleQubitSimulator
+import numpy as np
 
 def qrng(device: QuantumDevice) -> bool:
     with device.using_qubit() as q:
         q.h()
         return q.measure()
 
+def qrng_shots(device: QuantumDevice, shots: int) -> np.ndarray:
+    with device.using_qubit() as q:
+        q.h()
+        return q.sample(shots)
+
 if __name__ == "__main__":
     qsim = SingleQubitSimulator()
     for idx_sample in range(10):
@@ -0,0 +1,85 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+##
+# qrng_stream.py: Wraps the quantum random number generator in qrng.py as a
+#     buffered stream of random bytes.
+##
+# Copyright (c) Sarah Kaiser and Cassandra Granade.
+# Code sample from the book "Learn Quantum Computing with Python and Q#" by
+# Sarah Kaiser and Cassandra Granade, published by Manning Publications Co.
+# Book ISBN 9781617296130.
+# Code licensed under the MIT License.
+##
+
+import io
+import time
+from typing import Iterator, Optional
+import numpy as np
+
+from interface import QuantumDevice
+from simulator import SingleQubitSimulator
+from qrng import qrng_shots
+
+class QrngStream(io.RawIOBase):
+    """
+    A read-only, never-ending binary file of quantum random bytes.
+
+    Bytes are drawn from a pool of `buffer_size` bytes, which is refilled
+    by sampling 8 * `buffer_size` QRNG measurements at once whenever it
+    runs dry.
+    """
+    device: QuantumDevice
+    buffer_size: int
+
+    def __init__(self, device: Optional[QuantumDevice] = None,
+                 buffer_size: int = 1 << 20,
+                 rng: Optional[np.random.Generator] = None):
+        super().__init__()
+        self.device = SingleQubitSimulator(rng=rng) if device is None else device
+        self.buffer_size = buffer_size
+        self._pool = memoryview(b"")
+
+    def _refill(self) -> None:
+        bits = qrng_shots(self.device, 8 * self.buffer_size)
+        self._pool = memoryview(np.packbits(bits).tobytes())
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        buffer = memoryview(buffer).cast("B")
+        n_written = 0
+        while n_written < len(buffer):
+            if not self._pool:
+                self._refill()
+            n_copied = min(len(self._pool), len(buffer) - n_written)
+            buffer[n_written:n_written + n_copied] = self._pool[:n_copied]
+            self._pool = self._pool[n_copied:]
+            n_written += n_copied
+        return n_written
+
+    def readall(self) -> bytes:
+        raise io.UnsupportedOperation(
+            "A QRNG stream never ends; pass the number of bytes to read."
+        )
+
+    def chunks(self, chunk_size: Optional[int] = None) -> Iterator[bytes]:
+        chunk_size = self.buffer_size if chunk_size is None else chunk_size
+        while True:
+            yield self.read(chunk_size)
+
+    def __iter__(self) -> Iterator[bytes]:
+        return self.chunks()
+
+    def __next__(self) -> bytes:
+        return self.read(self.buffer_size)
+
+if __name__ == "__main__":
+    stream = QrngStream()
+    print(f"Our QRNG stream returned {stream.read(16).hex()}.")
+
+    n_bytes = 1 << 24
+    start = time.perf_counter()
+    stream.read(n_bytes)
+    elapsed = time.perf_counter() - start
+    print(f"Read {n_bytes / 2 ** 20:0.0f} MiB at {n_bytes / elapsed / 2 ** 20:0.1f} MiB/s.")
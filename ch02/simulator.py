@@ -12,6 +12,7 @@
 
 from interface import QuantumDevice, Qubit
 import numpy as np
+from typing import List, Optional, Sequence
 
 KET_0 = np.array([
     [1],
@@ -22,23 +23,90 @@ H = np.array([
     [1, -1]
 ], dtype=complex) / np.sqrt(2)
 
+class UniformSource:
+    """
+    Hands out uniform random numbers one at a time from blocks drawn all
+    at once from a NumPy Generator, rather than calling into the Generator
+    once per measurement.
+
+    The first block is small, and each block after it is twice as large
+    as the last, up to `block_size`, so that short-lived devices which
+    only measure a few times don't pay for a full block.
+    """
+    rng: np.random.Generator
+    block_size: int
+
+    def __init__(self, rng: Optional[np.random.Generator] = None,
+                 block_size: int = 1024, initial_block_size: int = 4):
+        self.rng = np.random.default_rng(rng)
+        self.block_size = block_size
+        self._next_size = min(initial_block_size, block_size)
+        self._block = np.empty(0)
+        self._idx = 0
+
+    def random(self) -> float:
+        if self._idx == len(self._block):
+            self._block = self.rng.random(self._next_size)
+            self._next_size = min(2 * self._next_size, self.block_size)
+            self._idx = 0
+        self._idx += 1
+        return float(self._block[self._idx - 1])
+
 class SimulatedQubit(Qubit):
-    def __init__(self):
-        self.reset()
+    qubit_id: int
+    parent: "SingleQubitSimulator"
+
+    def __init__(self, parent_simulator: "SingleQubitSimulator", id: int):
+        self.qubit_id = id
+        self.parent = parent_simulator
+
+    @property
+    def state(self) -> np.ndarray:
+        # A view of this qubit's row of the simulator's array of states,
+        # as a column vector.
+        return self.parent.states[self.qubit_id].reshape((2, 1))
 
     def h(self):
-        self.state = H @ self.state
+        self.parent.states[self.qubit_id] = H @ self.parent.states[self.qubit_id]
 
     def measure(self) -> bool:
-        pr0 = np.abs(self.state[0, 0]) ** 2
-        sample = np.random.random() <= pr0
+        pr0 = np.abs(self.parent.states[self.qubit_id, 0]) ** 2
+        sample = self.parent.uniforms.random() <= pr0
         return bool(0 if sample else 1)
 
+    def sample(self, shots: int) -> np.ndarray:
+        # Measurement does not disturb the state of this simulator, so many
+        # measurement outcomes can be drawn at once from the same state.
+        pr0 = np.abs(self.parent.states[self.qubit_id, 0]) ** 2
+        return self.parent.uniforms.rng.random(shots) > pr0
+
     def reset(self):
-        self.state = KET_0.copy()
+        self.parent.states[self.qubit_id] = KET_0[:, 0]
 
 class SingleQubitSimulator(QuantumDevice):
-    available_qubits = [SimulatedQubit()]
+    """
+    Simulates a pool of `capacity` qubits that are never entangled with
+    each other, so that the state of the whole pool is just one
+    single-qubit state per qubit, kept together as the rows of a
+    (capacity, 2) array. Each device has a pool of its own, and the
+    *_many methods act on many qubits of the pool in one NumPy operation.
+    """
+    capacity: int
+    available_qubits: List[SimulatedQubit]
+    states: np.ndarray
+    uniforms: UniformSource
+
+    def __init__(self, capacity: int = 1,
+                 rng: Optional[np.random.Generator] = None):
+        self.capacity = capacity
+        self.uniforms = UniformSource(rng)
+        self.states = np.zeros((capacity, 2), dtype=complex)
+        self.states[:, 0] = 1
+        # Hand out qubit 0 first.
+        self.available_qubits = [
+            SimulatedQubit(self, idx)
+            for idx in reversed(range(capacity))
+        ]
 
     def allocate_qubit(self) -> SimulatedQubit:
         if self.available_qubits:
@@ -46,3 +114,18 @@ class SingleQubitSimulator(QuantumDevice):
 
     def deallocate_qubit(self, qubit: SimulatedQubit):
         self.available_qubits.append(qubit)
+
+    def _ids(self, qubits: Sequence[SimulatedQubit]) -> np.ndarray:
+        return np.array([qubit.qubit_id for qubit in qubits], dtype=int)
+
+    def h_many(self, qubits: Sequence[SimulatedQubit]) -> None:
+        ids = self._ids(qubits)
+        self.states[ids] = self.states[ids] @ H.T
+
+    def measure_many(self, qubits: Sequence[SimulatedQubit]) -> np.ndarray:
+        pr0 = np.abs(self.states[self._ids(qubits), 0]) ** 2
+        return self.uniforms.rng.random(len(pr0)) > pr0
+
+    def reset_many(self, qubits: Sequence[SimulatedQubit]) -> None:
+        ids = self._ids(qubits)
+        self.states[ids] = KET_0[:, 0]
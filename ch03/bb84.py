@@ -14,7 +14,8 @@
 
 from interface import QuantumDevice, Qubit
 from simulator import SingleQubitSimulator
-from typing import List
+from typing import List, Optional
+import numpy as np
 
 def sample_random_bit(device: QuantumDevice) -> bool:
     with device.using_qubit() as q:
@@ -62,9 +63,11 @@ def send_single_bit_with_bb84(
 
     return ((your_message, your_basis), (eve_result, eve_basis))
 
-def simulate_bb84(n_bits: int) -> list:
-    your_device = SingleQubitSimulator()
-    eve_device = SingleQubitSimulator()
+def simulate_bb84(n_bits: int,
+                  rng: Optional[np.random.Generator] = None) -> list:
+    rng = np.random.default_rng(rng)
+    your_device = SingleQubitSimulator(rng=rng)
+    eve_device = SingleQubitSimulator(rng=rng)
 
     key = []
     n_rounds = 0
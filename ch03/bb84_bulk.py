@@ -0,0 +1,133 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+##
+# bb84_bulk.py: Simulates many rounds of the BB84 protocol at once, using
+#     NumPy arrays of single-qubit states in place of the one-qubit-at-a-time
+#     simulation in bb84.py, so as to generate long keys quickly.
+##
+# Copyright (c) Sarah Kaiser and Cassandra Granade.
+# Code sample from the book "Learn Quantum Computing with Python and Q#" by
+# Sarah Kaiser and Cassandra Granade, published by Manning Publications Co.
+# Book ISBN 9781617296130.
+# Code licensed under the MIT License.
+##
+
+import time
+from typing import Optional
+import numpy as np
+
+from simulator import KET_0, H, X
+
+def sample_random_bits(n_bits: int, rng: np.random.Generator) -> np.ndarray:
+    # Each byte of a packed array holds eight independent fair coin flips,
+    # just as measuring eight qubits prepared in |+⟩ would.
+    return rng.integers(0, 256, size=(n_bits + 7) // 8, dtype=np.uint8)
+
+def unpack(bits: np.ndarray, n_bits: int) -> np.ndarray:
+    return np.unpackbits(bits, count=n_bits).astype(bool)
+
+def send_bits_with_bb84(messages: np.ndarray,
+                        your_bases: np.ndarray,
+                        eve_bases: np.ndarray,
+                        rng: np.random.Generator) -> np.ndarray:
+    """
+    Plays one BB84 round for each entry of the given boolean arrays,
+    returning the bits that Eve measures.
+    """
+    n_rounds = len(messages)
+    states = np.repeat(KET_0.T, n_rounds, axis=0)
+
+    # prepare_message_qubit, applied to every round at once.
+    states = np.where(messages[:, np.newaxis], states @ X.T, states)
+    states = np.where(your_bases[:, np.newaxis], states @ H.T, states)
+
+    # measure_message_qubit, applied to every round at once.
+    states = np.where(eve_bases[:, np.newaxis], states @ H.T, states)
+    pr0 = np.abs(states[:, 0]) ** 2
+    return rng.random(n_rounds) > pr0
+
+def simulate_bb84(n_bits: int, batch_size: int = 1 << 20,
+                  rng: Optional[np.random.Generator] = None) -> bytes:
+    """
+    Generates an `n_bits`-long key, packed eight bits to a byte, by playing
+    BB84 rounds in batches and keeping the rounds where you and Eve chose
+    the same basis.
+    """
+    rng = np.random.default_rng(rng)
+    key_chunks = []
+    n_key_bits = 0
+    n_rounds = 0
+
+    while n_key_bits < n_bits:
+        n_rounds += batch_size
+        messages = sample_random_bits(batch_size, rng)
+        your_bases = sample_random_bits(batch_size, rng)
+        eve_bases = sample_random_bits(batch_size, rng)
+
+        # The rounds where the bases agree are those where the XOR of the
+        # packed bases is zero, so sifting can be done a byte at a time.
+        same_basis = unpack(~(your_bases ^ eve_bases), batch_size)
+        your_messages = unpack(messages, batch_size)
+        eve_results = send_bits_with_bb84(
+            your_messages,
+            unpack(your_bases, batch_size),
+            unpack(eve_bases, batch_size),
+            rng
+        )
+        assert np.array_equal(
+            your_messages[same_basis], eve_results[same_basis]
+        )
+
+        key_chunks.append(your_messages[same_basis])
+        n_key_bits += int(np.count_nonzero(same_basis))
+
+    key = np.concatenate(key_chunks)[:n_bits]
+    print(f"Took {n_rounds} rounds to generate a {n_bits}-bit key.")
+
+    return np.packbits(key).tobytes()
+
+def apply_one_time_pad(message: bytes, key: bytes) -> bytes:
+    return np.bitwise_xor(
+        np.frombuffer(message, dtype=np.uint8),
+        np.frombuffer(key, dtype=np.uint8)[:len(message)]
+    ).tobytes()
+
+def benchmark_bb84(n_bits: int = 1 << 24,
+                   rng: Optional[np.random.Generator] = None) -> float:
+    """
+    Returns the number of key bits per second that simulate_bb84 produces
+    when asked for an `n_bits`-long key.
+    """
+    start = time.perf_counter()
+    simulate_bb84(n_bits, rng=rng)
+    return n_bits / (time.perf_counter() - start)
+
+if __name__ == "__main__":
+    print("Generating a 96-bit key by simulating BB84...")
+    key = simulate_bb84(96, batch_size=256)
+    print(f"Got key                           0x{key.hex()}.")
+
+    message = np.packbits([
+        1, 1, 0, 1, 1, 0, 0, 0,
+        0, 0, 1, 1, 1, 1, 0, 1,
+        1, 1, 0, 1, 1, 1, 0, 0,
+        1, 0, 0, 1, 0, 1, 1, 0,
+        1, 1, 0, 1, 1, 0, 0, 0,
+        0, 0, 1, 1, 1, 1, 0, 1,
+        1, 1, 0, 1, 1, 1, 0, 0,
+        0, 0, 0, 0, 1, 1, 0, 1,
+        1, 1, 0, 1, 1, 0, 0, 0,
+        0, 0, 1, 1, 1, 1, 0, 1,
+        1, 1, 0, 1, 1, 1, 0, 0,
+        1, 0, 1, 1, 1, 0, 1, 1
+    ]).tobytes()
+    print(f"Using key to send secret message: 0x{message.hex()}.")
+
+    encrypted_message = apply_one_time_pad(message, key)
+    print(f"Encrypted message:                0x{encrypted_message.hex()}.")
+
+    decrypted_message = apply_one_time_pad(encrypted_message, key)
+    print(f"Eve decrypted to get:             0x{decrypted_message.hex()}.")
+
+    print("Benchmarking a 16-megabit key...")
+    print(f"Generated {benchmark_bb84() / 1e6:0.1f} megabits of key per second.")
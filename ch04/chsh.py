@@ -15,9 +15,9 @@
 # chapters 4 and 5. For the complete, finished example please see the code in
 # the `ch05` directory.
 
-import random
+import inspect
 from functools import partial
-from typing import Tuple, Callable
+from typing import Optional, Tuple, Callable
 import numpy as np
 
 from interface import QuantumDevice, Qubit
@@ -25,31 +25,50 @@ from simulator import Simulator
 
 Strategy = Tuple[Callable[[int], int], Callable[[int], int]]
 
-def random_bit() -> int:
-    return random.randint(0, 1)
+def random_bit(rng: np.random.Generator) -> int:
+    return int(rng.integers(2))
 
-def referee(strategy: Callable[[], Strategy]) -> bool:
-    you, eve = strategy()
-    your_input, eve_input = random_bit(), random_bit()
+def _start_strategy(strategy: Callable[..., Strategy],
+                    rng: np.random.Generator) -> Strategy:
+    # Strategies that take no arguments, as in the original
+    # Callable[[], Strategy] contract, are still called without one; only
+    # those that accept a generator are passed the referee's.
+    try:
+        inspect.signature(strategy).bind(rng)
+    except TypeError:
+        return strategy()
+    return strategy(rng)
+
+def referee(strategy: Callable[..., Strategy],
+            rng: Optional[np.random.Generator] = None) -> bool:
+    # The same generator picks the referee's questions and drives the
+    # measurements made by any strategy that accepts it, so one seed fixes
+    # the whole game.
+    rng = np.random.default_rng(rng)
+    you, eve = _start_strategy(strategy, rng)
+    your_input, eve_input = random_bit(rng), random_bit(rng)
     parity = 0 if you(your_input) == eve(eve_input) else 1
     return parity == (your_input and eve_input)
 
-def est_win_probability(strategy: Callable[[], Strategy],
-                        n_games: int = 1000) -> float:
+def est_win_probability(strategy: Callable[..., Strategy],
+                        n_games: int = 1000,
+                        rng: Optional[np.random.Generator] = None) -> float:
+    rng = np.random.default_rng(rng)
     return sum(
-        referee(strategy)
+        referee(strategy, rng)
         for idx_game in range(n_games)
     ) / n_games
 
-def constant_strategy() -> Strategy:
+def constant_strategy(rng: Optional[np.random.Generator] = None) -> Strategy:
     return (
         lambda your_input: 0,
         lambda eve_input: 0
     )
 
 import qutip as qt
-def quantum_strategy(initial_state: qt.Qobj) -> Strategy:
-    shared_system = Simulator(capacity=2)
+def quantum_strategy(initial_state: qt.Qobj,
+                     rng: Optional[np.random.Generator] = None) -> Strategy:
+    shared_system = Simulator(capacity=2, rng=rng)
     shared_system.register_state = initial_state
     your_qubit = shared_system.allocate_qubit()
     eve_qubit = shared_system.allocate_qubit()
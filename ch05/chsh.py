@@ -11,59 +11,245 @@
 # Code licensed under the MIT License.
 ##
 
-import random
+from concurrent.futures import ProcessPoolExecutor
+import inspect
 from functools import partial
-from typing import Tuple, Callable
+from typing import NamedTuple, Optional, Tuple, Callable
 import numpy as np
+from scipy.stats import norm
 
 from interface import QuantumDevice, Qubit
 from simulator import Simulator
 
 Strategy = Tuple[Callable[[int], int], Callable[[int], int]]
 
-def random_bit() -> int:
-    return random.randint(0, 1)
+def random_bit(rng: np.random.Generator) -> int:
+    return int(rng.integers(2))
 
-def referee(strategy: Callable[[], Strategy]) -> bool:
-    you, eve = strategy()
-    your_input, eve_input = random_bit(), random_bit()
+def _start_strategy(strategy: Callable[..., Strategy],
+                    rng: np.random.Generator) -> Strategy:
+    # Strategies that take no arguments, as in the original
+    # Callable[[], Strategy] contract, are still called without one; only
+    # those that accept a generator are passed the referee's.
+    try:
+        inspect.signature(strategy).bind(rng)
+    except TypeError:
+        return strategy()
+    return strategy(rng)
+
+def referee(strategy: Callable[..., Strategy],
+            rng: Optional[np.random.Generator] = None) -> bool:
+    # The same generator picks the referee's questions and drives the
+    # measurements made by any strategy that accepts it, so one seed fixes
+    # the whole game.
+    rng = np.random.default_rng(rng)
+    you, eve = _start_strategy(strategy, rng)
+    your_input, eve_input = random_bit(rng), random_bit(rng)
     parity = 0 if you(your_input) == eve(eve_input) else 1
     return parity == (your_input and eve_input)
 
-def est_win_probability(strategy: Callable[[], Strategy],
-                        n_games: int = 1000) -> float:
+def est_win_probability(strategy: Callable[..., Strategy],
+                        n_games: int = 1000,
+                        rng: Optional[np.random.Generator] = None) -> float:
+    rng = np.random.default_rng(rng)
     return sum(
-        referee(strategy)
+        referee(strategy, rng)
         for idx_game in range(n_games)
     ) / n_games
 
-def constant_strategy() -> Strategy:
+class WinEstimate(NamedTuple):
+    win_probability: float
+    n_wins: int
+    n_games: int
+    confidence_interval: Tuple[float, float]
+    # Only known for strategies that have been compiled, see
+    # CompiledStrategy below.
+    exact_win_probability: Optional[float] = None
+
+def _win_estimate(n_wins: int, n_games: int, confidence: float,
+                  exact_win_probability: Optional[float] = None) -> WinEstimate:
+    # Wilson score interval for the win probability.
+    p = n_wins / n_games
+    z = norm.ppf(0.5 + confidence / 2)
+    center = (p + z ** 2 / (2 * n_games)) / (1 + z ** 2 / n_games)
+    half_width = z / (1 + z ** 2 / n_games) * np.sqrt(
+        p * (1 - p) / n_games + z ** 2 / (4 * n_games ** 2)
+    )
+    return WinEstimate(
+        p, n_wins, n_games, (center - half_width, center + half_width),
+        exact_win_probability
+    )
+
+def _play_games(strategy: Callable[..., Strategy], n_games: int,
+                seed: np.random.SeedSequence) -> int:
+    # Each chunk of games gets a generator of its own, built from its own
+    # seed sequence, so that the games it plays don't depend on which
+    # process plays them.
+    rng = np.random.default_rng(seed)
+    return sum(
+        referee(strategy, rng)
+        for idx_game in range(n_games)
+    )
+
+def est_win_probability_parallel(strategy: Callable[..., Strategy],
+                                 n_games: int = 1000,
+                                 seed: Optional[int] = None,
+                                 max_workers: Optional[int] = None,
+                                 chunk_size: int = 1000,
+                                 confidence: float = 0.95) -> WinEstimate:
+    """
+    Estimates the win probability of a strategy by splitting the games
+    into chunks of `chunk_size` and playing the chunks in parallel across
+    a pool of processes.
+
+    Each chunk gets its own child of a SeedSequence built from `seed`, so
+    that for a fixed seed, the estimate is the same whatever the number of
+    workers. Also returns a Wilson score interval for the win probability
+    at the given confidence level.
+    """
+    chunk_sizes = [chunk_size] * (n_games // chunk_size)
+    if n_games % chunk_size:
+        chunk_sizes.append(n_games % chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        n_wins = sum(executor.map(
+            _play_games,
+            [strategy] * len(chunk_sizes), chunk_sizes, seeds
+        ))
+
+    return _win_estimate(n_wins, n_games, confidence)
+
+def constant_strategy(rng: Optional[np.random.Generator] = None) -> Strategy:
     return (
         lambda your_input: 0,
         lambda eve_input: 0
     )
 
 import qutip as qt
-def quantum_strategy(initial_state: qt.Qobj) -> Strategy:
-    shared_system = Simulator(capacity=2)
-    shared_system.register_state = initial_state
+YOUR_ANGLES = np.array([90 * np.pi / 180, 0])
+EVE_ANGLES = np.array([45 * np.pi / 180, 135 * np.pi / 180])
+
+def quantum_strategy(initial_state: qt.Qobj,
+                     rng: Optional[np.random.Generator] = None) -> Strategy:
+    shared_system = Simulator(capacity=2, rng=rng)
+    # Relabel the state as two qubits, so that a plain 4 × 1 ket such as
+    # qt.Qobj([[1], [0], [0], [1]]) can be passed in as well.
+    shared_system.register_state = qt.Qobj(
+        initial_state.full(), dims=[[2, 2], [1, 1]]
+    )
     your_qubit = shared_system.allocate_qubit()
     eve_qubit = shared_system.allocate_qubit()
 
-    shared_system.register_state = qt.bell_state()
-    your_angles = [90 * np.pi / 180, 0]
-    eve_angles = [45 * np.pi / 180, 135 * np.pi / 180]
-
     def you(your_input: int) -> int:
-        your_qubit.ry(your_angles[your_input])
+        your_qubit.ry(YOUR_ANGLES[your_input])
         return your_qubit.measure()
 
     def eve(eve_input: int) -> int:
-        eve_qubit.ry(eve_angles[eve_input])
+        eve_qubit.ry(EVE_ANGLES[eve_input])
         return eve_qubit.measure()
 
     return you, eve
 
+# WINNING_OUTCOMES[your_input, eve_input, your_output, eve_output] is True
+# when those outputs win the game for those inputs.
+WINNING_OUTCOMES = np.fromfunction(
+    lambda x, y, a, b: (a != b) == (x * y == 1), (2, 2, 2, 2), dtype=int
+)
+
+class CompiledStrategy(NamedTuple):
+    """
+    A strategy reduced to the joint distribution of its outputs for each
+    pair of inputs, with `outcome_probabilities[your_input, eve_input,
+    your_output, eve_output]` giving the probability of each outcome.
+
+    Since the distribution is only worked out once, every game that is
+    played with the same inputs can be sampled at once, and the win
+    probability is known exactly.
+    """
+    outcome_probabilities: np.ndarray
+
+    @property
+    def win_probability(self) -> float:
+        # The referee picks each pair of inputs with probability 1 / 4.
+        return float(np.sum(
+            self.outcome_probabilities * WINNING_OUTCOMES
+        ) / 4)
+
+    def play(self, n_games: int,
+             rng: Optional[np.random.Generator] = None) -> int:
+        rng = np.random.default_rng(rng)
+        games_per_input = rng.multinomial(n_games, [1 / 4] * 4).reshape((2, 2))
+        n_wins = 0
+        for your_input in range(2):
+            for eve_input in range(2):
+                probabilities = self.outcome_probabilities[
+                    your_input, eve_input
+                ].reshape(-1)
+                counts = rng.multinomial(
+                    games_per_input[your_input, eve_input],
+                    probabilities / probabilities.sum()
+                )
+                n_wins += int(counts @ WINNING_OUTCOMES[
+                    your_input, eve_input
+                ].reshape(-1))
+        return n_wins
+
+def _ry(angles: np.ndarray) -> np.ndarray:
+    # Stacks the same matrices as qt.ry for each angle, along the last two
+    # axes.
+    cos, sin = np.cos(angles / 2), np.sin(angles / 2)
+    return np.stack([
+        np.stack([cos, -sin], axis=-1),
+        np.stack([sin, cos], axis=-1)
+    ], axis=-2).astype(complex)
+
+def compile_quantum_strategy(initial_state: qt.Qobj,
+                             your_angles: np.ndarray = YOUR_ANGLES,
+                             eve_angles: np.ndarray = EVE_ANGLES
+    ) -> CompiledStrategy:
+    # quantum_strategy allocates your qubit first, and Simulator hands out
+    # qubits from the end of its list, so your qubit is the second factor
+    # of the register and eve's qubit is the first.
+    state = initial_state.full().reshape((2, 2))
+    amplitudes = np.einsum(
+        "xai,ybj,ji->xyab", _ry(np.asarray(your_angles)),
+        _ry(np.asarray(eve_angles)), state
+    )
+    return CompiledStrategy(np.abs(amplitudes) ** 2)
+
+def est_win_probability_compiled(compiled: CompiledStrategy,
+                                 n_games: int = 1000,
+                                 rng: Optional[np.random.Generator] = None,
+                                 confidence: float = 0.95) -> WinEstimate:
+    # The games are sampled from the compiled distribution itself, so this
+    # is only as right as the compilation; see check_compiled_strategy for
+    # a comparison against the simulator.
+    n_wins = compiled.play(n_games, rng)
+    return _win_estimate(
+        n_wins, n_games, confidence, compiled.win_probability
+    )
+
+def check_compiled_strategy(initial_state: qt.Qobj, n_games: int = 1000,
+                            rng: Optional[np.random.Generator] = None,
+                            confidence: float = 0.95) -> WinEstimate:
+    """
+    Plays `n_games` of quantum_strategy(initial_state) on the simulator,
+    and returns the estimate next to the exact win probability of
+    compile_quantum_strategy(initial_state). If the exact probability
+    falls outside of the confidence interval, the compiled strategy does
+    not describe the simulated one.
+    """
+    rng = np.random.default_rng(rng)
+    n_wins = sum(
+        referee(partial(quantum_strategy, initial_state), rng)
+        for idx_game in range(n_games)
+    )
+    return _win_estimate(
+        n_wins, n_games, confidence,
+        compile_quantum_strategy(initial_state).win_probability
+    )
+
 if __name__ == "__main__":
     constant_pr = est_win_probability(constant_strategy, 100)
     print(f"Constant strategy won {constant_pr:0.1%} of the time.")
@@ -75,3 +261,22 @@ if __name__ == "__main__":
                 )
     print(f"Quantum strategy won {quantum_pr:0.1%} of the time " \
           f"with initial state:\n{initial_state}.")
+
+    estimate = est_win_probability_compiled(
+        compile_quantum_strategy(initial_state), 1_000_000
+    )
+    print(f"Compiled quantum strategy won {estimate.win_probability:0.2%} " \
+          f"of {estimate.n_games} games (exactly {estimate.exact_win_probability:0.2%}).")
+
+    # A state that isn't symmetric between the two qubits, so that mixing
+    # up which qubit is which would show.
+    uneven_state = (
+        qt.tensor(qt.basis(2, 0), qt.basis(2, 0)) +
+        0.5 * qt.tensor(qt.basis(2, 0), qt.basis(2, 1)) +
+        qt.tensor(qt.basis(2, 1), qt.basis(2, 1))
+    ).unit()
+    check = check_compiled_strategy(uneven_state, 2000)
+    low, high = check.confidence_interval
+    print(f"Simulated quantum strategy won {check.win_probability:0.2%} " \
+          f"({low:0.2%} to {high:0.2%}) with an uneven initial state; " \
+          f"compiled: {check.exact_win_probability:0.2%}.")
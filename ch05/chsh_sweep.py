@@ -0,0 +1,192 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+##
+# chsh_sweep.py: Sweeps the measurement angles and initial state of the
+#     quantum CHSH strategy in chsh.py over whole grids at once, caching
+#     results on disk and refining the grid around the best strategy found.
+##
+# Copyright (c) Sarah Kaiser and Cassandra Granade.
+# Code sample from the book "Learn Quantum Computing with Python and Q#" by
+# Sarah Kaiser and Cassandra Granade, published by Manning Publications Co.
+# Book ISBN 9781617296130.
+# Code licensed under the MIT License.
+##
+
+import hashlib
+import os
+import time
+from typing import Callable, NamedTuple, Optional, Tuple, Union
+import numpy as np
+
+from chsh import _ry
+
+# Bumped whenever the way win probabilities are computed changes, so that
+# results cached by older versions are not reused.
+CACHE_VERSION = b"chsh-sweep-1"
+
+Angles = Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]
+StateFamily = Callable[[np.ndarray], np.ndarray]
+
+def partially_entangled(params: np.ndarray) -> np.ndarray:
+    # cos(θ)|00⟩ + sin(θ)|11⟩, from a product state at θ = 0 to a Bell
+    # state at θ = π / 4.
+    params = np.asarray(params, dtype=float)
+    states = np.zeros(params.shape + (4,), dtype=complex)
+    states[..., 0] = np.cos(params)
+    states[..., 3] = np.sin(params)
+    return states
+
+class SweepResult(NamedTuple):
+    """
+    Win probabilities of the quantum strategy over a grid, with
+    `win_probabilities[i, j, k, l, m]` for your angles
+    `your_angles[0][i]` and `your_angles[1][j]` (used for inputs 0 and 1),
+    eve's angles `eve_angles[0][k]` and `eve_angles[1][l]`, and the
+    initial state given by `state_params[m]`.
+    """
+    your_angles: Tuple[np.ndarray, np.ndarray]
+    eve_angles: Tuple[np.ndarray, np.ndarray]
+    state_params: np.ndarray
+    win_probabilities: np.ndarray
+
+    def best(self) -> Tuple[Tuple[float, float], Tuple[float, float], float, float]:
+        i, j, k, l, m = np.unravel_index(
+            np.argmax(self.win_probabilities), self.win_probabilities.shape
+        )
+        return (
+            (float(self.your_angles[0][i]), float(self.your_angles[1][j])),
+            (float(self.eve_angles[0][k]), float(self.eve_angles[1][l])),
+            float(self.state_params[m]),
+            float(self.win_probabilities[i, j, k, l, m])
+        )
+
+def _per_input(angles: Angles) -> Tuple[np.ndarray, np.ndarray]:
+    # A single array of angles is used for both inputs.
+    if isinstance(angles, np.ndarray) and angles.ndim == 1:
+        angles = (angles, angles)
+    return tuple(np.asarray(each, dtype=float).reshape(-1) for each in angles)
+
+def _pr_same_output(your_angles: np.ndarray, eve_angles: np.ndarray,
+                    states: np.ndarray) -> np.ndarray:
+    # Probability that both players output the same bit, for every pair
+    # of angles and every state at once. As in chsh.py, eve's qubit is the
+    # first factor of the register and yours the second.
+    amplitudes = np.einsum(
+        "pai,qbj,sji->pqsab",
+        _ry(your_angles), _ry(eve_angles), states.reshape((-1, 2, 2))
+    )
+    probabilities = np.abs(amplitudes) ** 2
+    return probabilities[..., 0, 0] + probabilities[..., 1, 1]
+
+def win_probabilities(your_angles: Angles, eve_angles: Angles,
+                      states: np.ndarray) -> np.ndarray:
+    """
+    Returns the exact win probability at every point of the grid spanned
+    by `your_angles`, `eve_angles` and `states`, laid out as in
+    SweepResult.
+    """
+    your_angles, eve_angles = _per_input(your_angles), _per_input(eve_angles)
+    # Each pair of inputs only involves one of your angles and one of
+    # eve's, so the grid is filled in from four much smaller tables.
+    same = [
+        [_pr_same_output(your_angles[x], eve_angles[y], states) for y in range(2)]
+        for x in range(2)
+    ]
+    return (
+        same[0][0][:, np.newaxis, :, np.newaxis, :] +
+        same[0][1][:, np.newaxis, np.newaxis, :, :] +
+        same[1][0][np.newaxis, :, :, np.newaxis, :] +
+        1 - same[1][1][np.newaxis, :, np.newaxis, :, :]
+    ) / 4
+
+def _cache_key(*arrays: np.ndarray) -> str:
+    digest = hashlib.sha256(CACHE_VERSION)
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(f"{array.dtype.str}{array.shape}".encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+def sweep(your_angles: Angles, eve_angles: Angles,
+          state_params: np.ndarray,
+          state_family: StateFamily = partially_entangled,
+          cache_dir: Optional[str] = None) -> SweepResult:
+    """
+    Evaluates the quantum strategy over a grid of angles and initial
+    states. If `cache_dir` is given, the win probabilities are saved there
+    under a hash of the angles and states, and loaded again rather than
+    recomputed when the same grid is swept a second time.
+    """
+    your_angles, eve_angles = _per_input(your_angles), _per_input(eve_angles)
+    state_params = np.asarray(state_params, dtype=float).reshape(-1)
+    states = state_family(state_params)
+
+    path = None
+    if cache_dir is not None:
+        key = _cache_key(*your_angles, *eve_angles, states)
+        path = os.path.join(cache_dir, f"{key}.npy")
+        if os.path.exists(path):
+            return SweepResult(
+                your_angles, eve_angles, state_params, np.load(path)
+            )
+
+    result = win_probabilities(your_angles, eve_angles, states)
+    if path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temporary file first, so that an interrupted sweep
+        # never leaves a partial result behind under the real key.
+        partial_path = f"{path}.{os.getpid()}.tmp"
+        with open(partial_path, "wb") as f:
+            np.save(f, result)
+        os.replace(partial_path, path)
+    return SweepResult(your_angles, eve_angles, state_params, result)
+
+def _zoom(values: np.ndarray, center: float, n_points: int) -> np.ndarray:
+    # A new grid of n_points spanning one old grid step either side of
+    # the center, so that each round narrows in on the maximum.
+    if len(values) < 2:
+        return np.array([center])
+    step = np.ptp(values) / (len(values) - 1)
+    return np.linspace(center - step, center + step, n_points)
+
+def refine_sweep(result: SweepResult, n_rounds: int = 5, n_points: int = 5,
+                 state_family: StateFamily = partially_entangled,
+                 cache_dir: Optional[str] = None) -> SweepResult:
+    """
+    Repeatedly sweeps a small grid around the best point of the previous
+    sweep, rather than sweeping the whole parameter space at a finer
+    resolution.
+    """
+    for _ in range(n_rounds):
+        your_best, eve_best, param_best, _ = result.best()
+        result = sweep(
+            tuple(
+                _zoom(values, center, n_points)
+                for values, center in zip(result.your_angles, your_best)
+            ),
+            tuple(
+                _zoom(values, center, n_points)
+                for values, center in zip(result.eve_angles, eve_best)
+            ),
+            _zoom(result.state_params, param_best, n_points),
+            state_family, cache_dir
+        )
+    return result
+
+if __name__ == "__main__":
+    import tempfile
+
+    angles = np.linspace(0, 2 * np.pi, 16, endpoint=False)
+    state_params = np.linspace(0, np.pi / 4, 8)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for attempt in ("first", "cached"):
+            start = time.perf_counter()
+            coarse = sweep(angles, angles, state_params, cache_dir=cache_dir)
+            elapsed = time.perf_counter() - start
+            print(f"Swept {coarse.win_probabilities.size} strategies ({attempt}) in {elapsed:0.3f} s.")
+
+        refined = refine_sweep(coarse, cache_dir=cache_dir)
+    your_best, eve_best, param_best, pr_best = refined.best()
+    print(f"Best strategy found wins {pr_best:0.6f} of the time, with your angles {your_best}, " \
+          f"eve's angles {eve_best} and θ = {param_best:0.4f}.")
+    print(f"The best possible quantum strategy wins {(2 + np.sqrt(2)) / 4:0.6f} of the time.")
@@ -14,11 +14,103 @@ from interface import QuantumDevice, Qubit
 import qutip as qt
 from qutip.qip.operations import hadamard_transform, gate_expand_1toN
 import numpy as np
-from typing import List
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
 
 KET_0 = qt.basis(2, 0)
 H = hadamard_transform()
 
+GATES = {
+    "h": lambda: H,
+    "x": qt.sigmax,
+    "ry": qt.ry
+}
+
+class GateCache:
+    """
+    A least-recently-used cache of gate matrices, bounded by the total
+    number of bytes used by the cached matrices.
+
+    Keys identify a gate by name and parameters, and (for operators that
+    have been expanded to act on a whole register) by the qubits it acts
+    on and the size of the register. The `hits`, `misses` and `evictions`
+    counters show how well the cache is working.
+    """
+    max_bytes: int
+    n_bytes: int
+    hits: int
+    misses: int
+    evictions: int
+
+    def __init__(self, max_bytes: int = 64 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self.clear()
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.n_bytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+        self.misses += 1
+        value = factory()
+        size = _nbytes(value)
+        if size <= self.max_bytes:
+            self._entries[key] = (value, size)
+            self.n_bytes += size
+            while self.n_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.n_bytes -= evicted_size
+                self.evictions += 1
+        return value
+
+GATE_CACHE = GateCache()
+
+def _nbytes(value: Any) -> int:
+    if isinstance(value, qt.Qobj):
+        value = value.data
+    if hasattr(value, "indptr"):
+        return value.data.nbytes + value.indices.nbytes + value.indptr.nbytes
+    return np.asarray(value).nbytes
+
+class UniformSource:
+    """
+    Hands out uniform random numbers one at a time from blocks drawn all
+    at once from a NumPy Generator, rather than calling into the Generator
+    once per measurement.
+
+    The first block is small, and each block after it is twice as large
+    as the last, up to `block_size`, so that short-lived devices which
+    only measure a few times don't pay for a full block.
+    """
+    rng: np.random.Generator
+    block_size: int
+
+    def __init__(self, rng: Optional[np.random.Generator] = None,
+                 block_size: int = 1024, initial_block_size: int = 4):
+        self.rng = np.random.default_rng(rng)
+        self.block_size = block_size
+        self._next_size = min(initial_block_size, block_size)
+        self._block = np.empty(0)
+        self._idx = 0
+
+    def random(self) -> float:
+        if self._idx == len(self._block):
+            self._block = self.rng.random(self._next_size)
+            self._next_size = min(2 * self._next_size, self.block_size)
+            self._idx = 0
+        self._idx += 1
+        return float(self._block[self._idx - 1])
+
 class SimulatedQubit(Qubit):
     qubit_id: int
     parent: "Simulator"
@@ -28,44 +120,56 @@ class SimulatedQubit(Qubit):
         self.parent = parent_simulator
 
     def h(self) -> None:
-        self.parent._apply(H, [self.qubit_id])
+        self.parent._apply_gate("h", [self.qubit_id])
 
     def ry(self, angle: float) -> None:
-        self.parent._apply(qt.ry(angle), [self.qubit_id])
+        self.parent._apply_gate("ry", [self.qubit_id], angle)
 
     def x(self) -> None:
-        self.parent._apply(qt.sigmax(), [self.qubit_id])
+        self.parent._apply_gate("x", [self.qubit_id])
 
     def measure(self) -> bool:
-        projectors = [
-            gate_expand_1toN(
-                qt.basis(2, outcome) * qt.basis(2, outcome).dag(),
-                self.parent.capacity,
-                self.qubit_id
-            )
-            for outcome in (0, 1)
-        ]
-        post_measurement_states = [
-            projector * self.parent.register_state
-            for projector in projectors
-        ]
-        probabilities = [
-            post_measurement_state.norm() ** 2
-            for post_measurement_state in post_measurement_states
-        ]
-        sample = np.random.choice([0, 1], p=probabilities)
-        self.parent.register_state = post_measurement_states[sample].unit()
+        known = self.parent._known
+        if self.qubit_id in known:
+            self.parent.measurements_skipped += 1
+            return bool(known[self.qubit_id])
+
+        # Rather than building full-register projectors, view the register
+        # as a (2,) * capacity tensor and sum the squared amplitudes on the
+        # slice of this qubit's axis where it is in |1⟩.
+        register_state = self.parent.register_state
+        state = register_state.full().reshape((2,) * self.parent.capacity)
+        slice_1 = state[(slice(None),) * self.qubit_id + (1,)]
+        pr1 = np.vdot(slice_1, slice_1).real
+        sample = int(self.parent.uniforms.random() < pr1)
+
+        state[(slice(None),) * self.qubit_id + (1 - sample,)] = 0
+        state /= np.sqrt(pr1 if sample else 1 - pr1)
+        self.parent._register_state = qt.Qobj(
+            state.reshape((-1, 1)), dims=register_state.dims
+        )
+        known[self.qubit_id] = sample
         return bool(sample)
 
     def reset(self) -> None:
+        if self.parent._known.get(self.qubit_id) == 0:
+            self.parent.resets_skipped += 1
+            return
         if self.measure(): self.x()
 
 class Simulator(QuantumDevice):
     capacity: int
     available_qubits: List[SimulatedQubit]
-    register_state: qt.Qobj
-    def __init__(self, capacity=3):
+    gate_cache: GateCache
+    uniforms: UniformSource
+    measurements_skipped: int
+    resets_skipped: int
+    _known: Dict[int, int]
+    def __init__(self, capacity=3, gate_cache: Optional[GateCache] = None,
+                 rng: Optional[np.random.Generator] = None):
         self.capacity = capacity
+        self.gate_cache = GATE_CACHE if gate_cache is None else gate_cache
+        self.uniforms = UniformSource(rng)
         self.available_qubits = [
             SimulatedQubit(self, idx)
             for idx in range(capacity)
@@ -76,6 +180,22 @@ class Simulator(QuantumDevice):
                 for _ in range(capacity)
             ]
         )
+        # Qubits known to be in a computational basis state, by id, so
+        # that measuring or resetting them can skip the full register.
+        self._known = {idx: 0 for idx in range(capacity)}
+        self.measurements_skipped = 0
+        self.resets_skipped = 0
+
+    @property
+    def register_state(self) -> qt.Qobj:
+        return self._register_state
+
+    @register_state.setter
+    def register_state(self, new_state: qt.Qobj) -> None:
+        # An arbitrary new state may put any qubit in superposition.
+        self._register_state = new_state
+        self._known = {}
+
     def allocate_qubit(self) -> SimulatedQubit:
         if self.available_qubits:
             return self.available_qubits.pop()
@@ -85,11 +205,33 @@ class Simulator(QuantumDevice):
 
     def _apply(self, unitary: qt.Qobj, ids: List[int]):
         if len(ids) == 1:
-            matrix = qt.circuit.gate_expand_1toN(
+            matrix = gate_expand_1toN(
                 unitary, self.capacity, ids[0]
             )
         else:
             raise ValueError("Only single-qubit unitary matrices are supported.")
 
-        self.register_state = matrix * self.register_state
+        self._register_state = matrix * self.register_state
+        self._known.pop(ids[0], None)
+
+    def _apply_gate(self, name: str, ids: List[int], *params: float):
+        # Both the gate itself and its expansion to the full register are
+        # looked up in the cache, so that repeating the same gate on the
+        # same qubit doesn't rebuild either of them.
+        if len(ids) != 1:
+            raise ValueError("Only single-qubit unitary matrices are supported.")
+        unitary = self.gate_cache.get(
+            (name, params), lambda: GATES[name](*params)
+        )
+        matrix = self.gate_cache.get(
+            (name, params, tuple(ids), self.capacity),
+            lambda: gate_expand_1toN(unitary, self.capacity, ids[0])
+        )
+        self._register_state = matrix * self.register_state
+        # X maps basis states to basis states; H and Ry may not.
+        if ids[0] in self._known:
+            if name == "x":
+                self._known[ids[0]] ^= 1
+            else:
+                del self._known[ids[0]]
 
@@ -0,0 +1,120 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+##
+# circuit.py: Defines a minimal representation of quantum circuits, and a
+#     pass that fuses runs of gates together so that the simulator in
+#     simulator.py has fewer gates to apply.
+##
+# Copyright (c) Sarah Kaiser and Cassandra Granade.
+# Code sample from the book "Learn Quantum Computing with Python and Q#" by
+# Sarah Kaiser and Cassandra Granade, published by Manning Publications Co.
+# Book ISBN 9781617296130.
+# Code licensed under the MIT License.
+##
+
+from typing import Dict, Hashable, List, NamedTuple, Optional, Sequence, Tuple
+import numpy as np
+
+class Instruction(NamedTuple):
+    matrix: np.ndarray
+    ids: Tuple[int, ...]
+    # A key that names the gate (such as ("ry", (0.1,))), or None if the
+    # matrix doesn't correspond to a single named gate.
+    key: Optional[Hashable] = None
+
+def _kron(matrices: Sequence[np.ndarray]) -> np.ndarray:
+    result = np.eye(1, dtype=complex)
+    for matrix in matrices:
+        result = np.kron(result, matrix)
+    return result
+
+def _permute(matrix: np.ndarray, ids: Sequence[int],
+             new_ids: Sequence[int]) -> np.ndarray:
+    # Rewrites a k-qubit gate on `ids` as the same gate with its qubits
+    # listed in the order given by `new_ids`.
+    n_targets = len(ids)
+    order = [list(ids).index(qubit_id) for qubit_id in new_ids]
+    tensor = matrix.reshape((2,) * (2 * n_targets))
+    tensor = np.transpose(tensor, order + [n_targets + idx for idx in order])
+    return tensor.reshape(2 ** n_targets, 2 ** n_targets)
+
+def _is_identity(matrix: np.ndarray, atol: float = 1e-12) -> bool:
+    # Gates that differ from the identity only by a global phase have no
+    # effect on the state, so they can be dropped as well.
+    phase = matrix[0, 0]
+    return (
+        np.isclose(abs(phase), 1, atol=atol) and
+        np.allclose(matrix, phase * np.eye(len(matrix)), atol=atol)
+    )
+
+def fuse(instructions: Sequence[Instruction]) -> List[Instruction]:
+    """
+    Returns a circuit with the same effect as `instructions`, but with
+    fewer gates:
+
+    - consecutive single-qubit gates on the same qubit are multiplied
+      together into one 2 × 2 matrix, and dropped entirely if they cancel
+      (as H·H or X·X do);
+    - single-qubit gates are absorbed into the multi-qubit gate that
+      precedes or follows them on that qubit;
+    - multi-qubit gates acting on the same qubits with nothing in between
+      are multiplied together, and dropped if they cancel.
+    """
+    fused: List[Instruction] = []
+    # Single-qubit gates that have been seen since the last multi-qubit
+    # gate on each qubit, already multiplied together.
+    pending: Dict[int, Instruction] = {}
+
+    for instruction in instructions:
+        ids = tuple(instruction.ids)
+        if len(ids) == 1:
+            previous = pending.get(ids[0])
+            pending[ids[0]] = instruction if previous is None else Instruction(
+                instruction.matrix @ previous.matrix, ids
+            )
+            continue
+
+        identity = np.eye(2, dtype=complex)
+        before = _kron([
+            pending.pop(qubit_id).matrix if qubit_id in pending else identity
+            for qubit_id in ids
+        ])
+        matrix = instruction.matrix @ before
+        key = instruction.key if _is_identity(before) else None
+
+        # Look back past gates on other qubits for a gate on the same
+        # qubits that this one can be merged into.
+        for idx in range(len(fused) - 1, -1, -1):
+            previous = fused[idx]
+            if set(previous.ids) == set(ids):
+                matrix = matrix @ _permute(previous.matrix, previous.ids, ids)
+                del fused[idx]
+                key = None
+                break
+            if set(previous.ids) & set(ids):
+                break
+
+        if not _is_identity(matrix):
+            fused.append(Instruction(matrix, ids, key))
+
+    # Whatever is left over on each qubit comes after every other gate on
+    # that qubit, so it can be absorbed into the last gate that acts on it.
+    for qubit_id, instruction in pending.items():
+        if _is_identity(instruction.matrix):
+            continue
+        for idx in range(len(fused) - 1, -1, -1):
+            previous = fused[idx]
+            if qubit_id in previous.ids:
+                after = _kron([
+                    instruction.matrix if other_id == qubit_id
+                    else np.eye(2, dtype=complex)
+                    for other_id in previous.ids
+                ])
+                fused[idx] = Instruction(
+                    after @ previous.matrix, previous.ids
+                )
+                break
+        else:
+            fused.append(instruction)
+
+    return fused
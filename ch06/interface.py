@@ -13,6 +13,8 @@
 
 from abc import ABCMeta, abstractmethod
 from contextlib import contextmanager
+from typing import Any, Callable, List
+import numpy as np
 
 class Qubit(metaclass=ABCMeta):
 
@@ -53,6 +55,22 @@ class QuantumDevice(metaclass=ABCMeta):
     def deallocate_qubit(self, qubit: Qubit):
         pass
 
+    def measure_many(self, qubits: List[Qubit]) -> List[bool]:
+        return [qubit.measure() for qubit in qubits]
+
+    def run_shots(self, program: Callable[["QuantumDevice"], Any],
+                  shots: int) -> np.ndarray:
+        return np.array([
+            program(self)
+            for idx_shot in range(shots)
+        ], dtype=int)
+
+    @contextmanager
+    def recording(self):
+        # Devices that can defer and optimize the gates applied within
+        # this block override it; by default, gates are applied right away.
+        yield
+
     @contextmanager
     def using_qubit(self):
         qubit = self.allocate_qubit()
@@ -0,0 +1,229 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+##
+# mps.py: Defines a simulator that represents its register as a matrix
+#     product state (MPS), so that long chains of qubits with little
+#     entanglement between them can be simulated with the interface defined
+#     in interface.py.
+##
+# Copyright (c) Sarah Kaiser and Cassandra Granade.
+# Code sample from the book "Learn Quantum Computing with Python and Q#" by
+# Sarah Kaiser and Cassandra Granade, published by Manning Publications Co.
+# Book ISBN 9781617296130.
+# Code licensed under the MIT License.
+##
+
+from interface import QuantumDevice
+from simulator import (
+    GATE_CACHE, GateCache, SimulatedQubit, UniformSource, _as_matrix,
+    _cached_gate_matrix
+)
+import heapq
+import numpy as np
+import qutip as qt
+from typing import List, Optional, Sequence
+
+class MPSSimulator(QuantumDevice):
+    """
+    Simulates a chain of qubits as a matrix product state: one tensor of
+    shape (left bond, 2, right bond) per qubit.
+
+    The state is kept in mixed canonical form around a single site, so
+    that measurement probabilities can be read off that site alone, and
+    so that cutting small singular values after a two-qubit gate discards
+    as little of the state as possible. At most `max_bond` singular
+    values are kept on each bond, and any whose share of the total weight
+    is below `threshold` are dropped; the weight thrown away is added up
+    in `truncation_error`.
+
+    Two-qubit gates on qubits that are not neighbours are applied by
+    swapping one qubit along the chain, so the cost of a gate grows with
+    the distance between its qubits.
+    """
+    capacity: int
+    available_qubits: List[SimulatedQubit]
+    tensors: List[np.ndarray]
+    max_bond: int
+    threshold: float
+    truncation_error: float
+    gate_cache: GateCache
+    rng: np.random.Generator
+
+    def __init__(self, capacity=3, max_bond: int = 64,
+                 threshold: float = 1e-12,
+                 gate_cache: Optional[GateCache] = None,
+                 rng: Optional[np.random.Generator] = None):
+        self.capacity = capacity
+        self.max_bond = max_bond
+        self.threshold = threshold
+        self.truncation_error = 0.0
+        self.gate_cache = GATE_CACHE if gate_cache is None else gate_cache
+        self._uniforms = UniformSource(rng)
+        self.rng = self._uniforms.rng
+        self.available_qubits = [
+            SimulatedQubit(self, idx)
+            for idx in range(capacity)
+        ]
+        heapq.heapify(self.available_qubits)
+
+        ket_0 = np.array([1, 0], dtype=complex).reshape((1, 2, 1))
+        self.tensors = [ket_0.copy() for _ in range(capacity)]
+        self._center = 0
+
+    def allocate_qubit(self) -> SimulatedQubit:
+        if self.available_qubits:
+            return heapq.heappop(self.available_qubits)
+
+    def deallocate_qubit(self, qubit: SimulatedQubit):
+        heapq.heappush(self.available_qubits, qubit)
+
+    @property
+    def bond_dimensions(self) -> List[int]:
+        return [tensor.shape[2] for tensor in self.tensors[:-1]]
+
+    def _move_center(self, site: int) -> None:
+        # Sweeps the orthogonality center to `site` with QR decompositions,
+        # leaving every tensor to its left left-canonical and every tensor
+        # to its right right-canonical.
+        while self._center < site:
+            tensor = self.tensors[self._center]
+            left, _, right = tensor.shape
+            q, r = np.linalg.qr(tensor.reshape((left * 2, right)))
+            self.tensors[self._center] = q.reshape((left, 2, -1))
+            self.tensors[self._center + 1] = np.einsum(
+                "ab,bjc->ajc", r, self.tensors[self._center + 1]
+            )
+            self._center += 1
+        while self._center > site:
+            tensor = self.tensors[self._center]
+            left, _, right = tensor.shape
+            q, r = np.linalg.qr(tensor.reshape((left, 2 * right)).T)
+            self.tensors[self._center] = q.T.reshape((-1, 2, right))
+            self.tensors[self._center - 1] = np.einsum(
+                "ajb,cb->ajc", self.tensors[self._center - 1], r
+            )
+            self._center -= 1
+
+    def _apply_single(self, matrix: np.ndarray, site: int) -> None:
+        self.tensors[site] = np.einsum("ij,ajb->aib", matrix, self.tensors[site])
+
+    def _apply_adjacent(self, matrix: np.ndarray, site: int) -> None:
+        # Applies a two-qubit gate to sites (site, site + 1), then splits
+        # the result back into two tensors with a truncated SVD.
+        self._move_center(site)
+        left = self.tensors[site].shape[0]
+        right = self.tensors[site + 1].shape[2]
+        theta = np.einsum(
+            "aib,bjc->aijc", self.tensors[site], self.tensors[site + 1]
+        )
+        theta = np.einsum(
+            "ijkl,aklc->aijc", matrix.reshape((2, 2, 2, 2)), theta
+        )
+        u, s, vh = np.linalg.svd(
+            theta.reshape((left * 2, 2 * right)), full_matrices=False
+        )
+
+        weights = s ** 2 / np.sum(s ** 2)
+        n_kept = max(1, min(
+            self.max_bond, int(np.count_nonzero(weights >= self.threshold))
+        ))
+        self.truncation_error += float(np.sum(weights[n_kept:]))
+        s = s[:n_kept] / np.linalg.norm(s[:n_kept])
+
+        self.tensors[site] = u[:, :n_kept].reshape((left, 2, n_kept))
+        self.tensors[site + 1] = (
+            s[:, np.newaxis] * vh[:n_kept]
+        ).reshape((n_kept, 2, right))
+        self._center = site + 1
+
+    def _apply(self, unitary, ids: List[int], cache_key=None):
+        matrix = _as_matrix(unitary)
+        if len(ids) == 1:
+            self._apply_single(matrix, ids[0])
+            return
+        if len(ids) != 2:
+            raise ValueError("Only one- or two-qubit unitary matrices supported.")
+
+        a, b = ids
+        if a > b:
+            # Relabel the gate so that it acts on (b, a) in that order.
+            matrix = matrix.reshape((2,) * 4).transpose(
+                (1, 0, 3, 2)
+            ).reshape((4, 4))
+            a, b = b, a
+        swap = self._gate_matrix("swap")
+        for site in range(b - 1, a, -1):
+            self._apply_adjacent(swap, site)
+        self._apply_adjacent(matrix, a)
+        for site in range(a + 1, b):
+            self._apply_adjacent(swap, site)
+
+    def _gate_matrix(self, name: str, *params: float) -> np.ndarray:
+        return _cached_gate_matrix(self.gate_cache, name, *params)
+
+    def _apply_gate(self, name: str, ids: List[int], *params: float):
+        self._apply(self._gate_matrix(name, *params), ids, (name, params))
+
+    def _apply_controlled(self, name: str, controls: Sequence[int],
+                          targets: Sequence[int], *params: float) -> None:
+        # A singly-controlled single-qubit gate is an ordinary two-qubit
+        # gate on the chain; anything larger would need a decomposition
+        # into two-qubit gates first.
+        if len(controls) + len(targets) > 2:
+            raise ValueError(
+                "MPSSimulator only supports controlled gates on two qubits in total."
+            )
+        matrix = self._gate_matrix(name, *params)
+        n_targets = 2 ** len(targets)
+        controlled = np.eye(2 ** len(controls) * n_targets, dtype=complex)
+        controlled[-n_targets:, -n_targets:] = matrix
+        self._apply(controlled, list(controls) + list(targets))
+
+    def _measure(self, qubit_id: int) -> int:
+        self._move_center(qubit_id)
+        tensor = self.tensors[qubit_id]
+        pr1 = np.vdot(tensor[:, 1, :], tensor[:, 1, :]).real
+        pr1 /= np.vdot(tensor, tensor).real
+        sample = int(self._uniforms.random() < pr1)
+
+        tensor[:, 1 - sample, :] = 0
+        tensor /= np.linalg.norm(tensor)
+        return sample
+
+    def _reset(self, qubit_id: int) -> None:
+        if self._measure(qubit_id):
+            self._apply_gate("x", [qubit_id])
+
+    @property
+    def register_state(self) -> qt.Qobj:
+        # Only practical for small registers, but useful for checking
+        # results against the other simulators.
+        state = np.ones((1, 1), dtype=complex)
+        for tensor in self.tensors:
+            state = np.einsum("xa,ajb->xjb", state, tensor).reshape(
+                (-1, tensor.shape[2])
+            )
+        return qt.Qobj(
+            state.reshape((-1, 1)),
+            dims=[[2] * self.capacity, [1] * self.capacity]
+        )
+
+    def dump(self) -> None:
+        print(f"Bond dimensions: {self.bond_dimensions}")
+        print(f"Truncation error: {self.truncation_error}")
+
+if __name__ == "__main__":
+    from teleport import teleport
+
+    # Teleport a qubit down a chain of 101 qubits, one hop at a time.
+    n_hops = 50
+    angle = 0.123
+    sim = MPSSimulator(capacity=2 * n_hops + 1, max_bond=8)
+    with sim.using_register(2 * n_hops + 1) as qubits:
+        qubits[0].ry(angle)
+        for hop in range(n_hops):
+            msg, here, there = qubits[2 * hop:2 * hop + 3]
+            teleport(msg, here, there)
+        qubits[-1].ry(-angle)
+        print(f"Measured {qubits[-1].measure()} after {n_hops} hops (expected 0).")
+        sim.dump()
@@ -0,0 +1,302 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+##
+# noise.py: Defines common noise channels, and two ways of simulating qubits
+#     affected by them with the interface defined in interface.py: exactly,
+#     by tracking the density matrix of the register, or approximately, by
+#     sampling Monte Carlo trajectories of the state vector.
+##
+# Copyright (c) Sarah Kaiser and Cassandra Granade.
+# Code sample from the book "Learn Quantum Computing with Python and Q#" by
+# Sarah Kaiser and Cassandra Granade, published by Manning Publications Co.
+# Book ISBN 9781617296130.
+# Code licensed under the MIT License.
+##
+
+from interface import QuantumDevice
+from simulator import (
+    GATE_CACHE, GateCache, SimulatedQubit, Simulator, UniformSource,
+    _apply_1q, _apply_kq, _as_matrix, _cached_gate_matrix
+)
+import heapq
+from contextlib import contextmanager
+import numpy as np
+import qutip as qt
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Union
+
+I = np.eye(2, dtype=complex)
+X = np.array([[0, 1], [1, 0]], dtype=complex)
+Y = np.array([[0, -1j], [1j, 0]], dtype=complex)
+Z = np.array([[1, 0], [0, -1]], dtype=complex)
+
+# Each channel is given by its Kraus operators, stacked into an array of
+# shape (n_kraus, 2, 2).
+Channel = np.ndarray
+
+def depolarizing(p: float) -> Channel:
+    # With probability p, the qubit is replaced by the maximally mixed state.
+    return np.array([
+        np.sqrt(1 - 3 * p / 4) * I,
+        np.sqrt(p / 4) * X,
+        np.sqrt(p / 4) * Y,
+        np.sqrt(p / 4) * Z
+    ])
+
+def dephasing(p: float) -> Channel:
+    # With probability p, a Z gate is applied to the qubit.
+    return np.array([
+        np.sqrt(1 - p) * I,
+        np.sqrt(p) * Z
+    ])
+
+def amplitude_damping(gamma: float) -> Channel:
+    # With probability gamma, a qubit in |1⟩ decays to |0⟩.
+    return np.array([
+        [[1, 0], [0, np.sqrt(1 - gamma)]],
+        [[0, np.sqrt(gamma)], [0, 0]]
+    ], dtype=complex)
+
+class NoiseModel:
+    """
+    Says which single-qubit channels act after each gate: those attached
+    to the type of gate (such as "h" or "cnot"), followed by those
+    attached to each qubit that the gate acts on.
+    """
+    after_gate: Dict[str, List[Channel]]
+    on_qubit: Dict[int, List[Channel]]
+
+    def __init__(self,
+                 after_gate: Optional[Dict[str, List[Channel]]] = None,
+                 on_qubit: Optional[Dict[int, List[Channel]]] = None):
+        self.after_gate = {} if after_gate is None else after_gate
+        self.on_qubit = {} if on_qubit is None else on_qubit
+
+    def channels(self, gate_name: Optional[str],
+                 qubit_id: int) -> List[Channel]:
+        return (
+            self.after_gate.get(gate_name, []) +
+            self.on_qubit.get(qubit_id, [])
+        )
+
+class DensityMatrixSimulator(QuantumDevice):
+    """
+    Simulates a noisy register by tracking its full density matrix, kept
+    as a (2,) * 2n tensor whose first n axes are the ket side and last n
+    axes the bra side of each qubit.
+
+    Channels are applied by contracting all of their Kraus operators
+    against just the two axes of the qubit they act on, so no operator on
+    the whole register is ever built.
+    """
+    capacity: int
+    available_qubits: List[SimulatedQubit]
+    state: np.ndarray
+    noise_model: NoiseModel
+    gate_cache: GateCache
+    rng: np.random.Generator
+
+    def __init__(self, capacity=3,
+                 noise_model: Optional[NoiseModel] = None,
+                 gate_cache: Optional[GateCache] = None,
+                 rng: Optional[np.random.Generator] = None):
+        self.capacity = capacity
+        self.noise_model = NoiseModel() if noise_model is None else noise_model
+        self.gate_cache = GATE_CACHE if gate_cache is None else gate_cache
+        self._uniforms = UniformSource(rng)
+        self.rng = self._uniforms.rng
+        self.available_qubits = [
+            SimulatedQubit(self, idx)
+            for idx in range(capacity)
+        ]
+        heapq.heapify(self.available_qubits)
+        self.state = np.zeros((2,) * (2 * capacity), dtype=complex)
+        self.state[(0,) * (2 * capacity)] = 1
+
+    @property
+    def register_state(self) -> qt.Qobj:
+        dimension = 2 ** self.capacity
+        return qt.Qobj(
+            self.state.reshape((dimension, dimension)),
+            dims=[[2] * self.capacity, [2] * self.capacity]
+        )
+
+    @register_state.setter
+    def register_state(self, new_state: Union[qt.Qobj, np.ndarray]) -> None:
+        new_state = _as_matrix(new_state)
+        if new_state.shape[1] == 1:
+            new_state = new_state @ new_state.conj().T
+        self.state = np.array(new_state, dtype=complex).reshape(
+            (2,) * (2 * self.capacity)
+        )
+
+    def allocate_qubit(self) -> SimulatedQubit:
+        if self.available_qubits:
+            return heapq.heappop(self.available_qubits)
+
+    def deallocate_qubit(self, qubit: SimulatedQubit):
+        heapq.heappush(self.available_qubits, qubit)
+
+    def _apply(self, unitary: Union[qt.Qobj, np.ndarray], ids: List[int],
+               cache_key: Optional[Hashable] = None):
+        # ρ ↦ U ρ U†, with U contracted against the ket axes and U* against
+        # the bra axes of the target qubits.
+        matrix = _as_matrix(unitary)
+        bra_ids = [qubit_id + self.capacity for qubit_id in ids]
+        self.state = _apply_kq(self.state, matrix, ids)
+        self.state = _apply_kq(self.state, matrix.conj(), bra_ids)
+        self._apply_noise(ids, cache_key)
+
+    def _apply_noise(self, ids: Sequence[int],
+                     cache_key: Optional[Hashable]) -> None:
+        gate_name = cache_key[0] if cache_key is not None else None
+        for qubit_id in ids:
+            for channel in self.noise_model.channels(gate_name, qubit_id):
+                self.apply_channel(channel, qubit_id)
+
+    def _gate_matrix(self, name: str, *params: float) -> np.ndarray:
+        return _cached_gate_matrix(self.gate_cache, name, *params)
+
+    def _apply_gate(self, name: str, ids: List[int], *params: float):
+        self._apply(self._gate_matrix(name, *params), ids, (name, params))
+
+    def _apply_controlled(self, name: str, controls: Sequence[int],
+                          targets: Sequence[int], *params: float) -> None:
+        # As in Simulator._apply_controlled, but once for each side of ρ:
+        # U acts on the ket axes of the targets only in the slice where the
+        # ket axes of every control are 1, and U* likewise on the bra side.
+        ids = list(controls) + list(targets)
+        if len(set(ids)) != len(ids):
+            raise ValueError(f"A gate can't act on the same qubit twice: {ids}.")
+        matrix = self._gate_matrix(name, *params)
+        for offset, side_matrix in ((0, matrix), (self.capacity, matrix.conj())):
+            control_axes = [qubit_id + offset for qubit_id in controls]
+            index = [slice(None)] * self.state.ndim
+            for axis in control_axes:
+                index[axis] = 1
+            index = tuple(index) + (Ellipsis,)
+            target_axes = [
+                axis - sum(control_axis < axis for control_axis in control_axes)
+                for axis in (qubit_id + offset for qubit_id in targets)
+            ]
+            self.state[index] = _apply_kq(
+                self.state[index], side_matrix, target_axes
+            )
+        self._apply_noise(ids, (name, params))
+
+    def apply_channel(self, channel: Channel, qubit_id: int) -> None:
+        # ρ ↦ Σₖ Kₖ ρ Kₖ†, for every Kraus operator at once.
+        axes = [qubit_id, qubit_id + self.capacity]
+        block = np.moveaxis(self.state, axes, [0, 1])
+        block = np.einsum(
+            "kij,jl...,kml->im...", channel, block, channel.conj()
+        )
+        self.state = np.ascontiguousarray(np.moveaxis(block, [0, 1], axes))
+
+    def _measure(self, qubit_id: int) -> int:
+        dimension = 2 ** self.capacity
+        populations = np.diagonal(
+            self.state.reshape((dimension, dimension))
+        ).real.reshape((2,) * self.capacity)
+        pr1 = np.sum(populations[(slice(None),) * qubit_id + (1,)])
+        sample = int(self._uniforms.random() < pr1)
+
+        # Keep only the block of ρ where both the ket and the bra sides
+        # of the measured qubit agree with the outcome.
+        ket = (slice(None),) * qubit_id
+        bra = (slice(None),) * (qubit_id + self.capacity)
+        self.state[ket + (1 - sample,)] = 0
+        self.state[bra + (1 - sample,)] = 0
+        self.state /= pr1 if sample else 1 - pr1
+        return sample
+
+    def _reset(self, qubit_id: int) -> None:
+        if self._measure(qubit_id):
+            self._apply_gate("x", [qubit_id])
+
+    def dump(self) -> None:
+        print(self.register_state)
+
+class TrajectorySimulator(Simulator):
+    """
+    Simulates a noisy register as a state vector, picking one Kraus
+    operator of each channel at random (with the probability that it
+    would occur) every time the channel acts. Each run of a program then
+    follows one trajectory, and averaging over many runs reproduces the
+    density matrix simulation with memory that grows as 2^n rather than
+    4^n.
+    """
+    noise_model: NoiseModel
+
+    def __init__(self, capacity=3,
+                 noise_model: Optional[NoiseModel] = None,
+                 **kwargs):
+        super().__init__(capacity, **kwargs)
+        self.noise_model = NoiseModel() if noise_model is None else noise_model
+
+    @contextmanager
+    def recording(self):
+        # Noise acts after every individual gate, so fusing gates together
+        # would change the noise model; apply each gate as it comes.
+        yield
+
+    def _after_gate(self, ids: Sequence[int],
+                    cache_key: Optional[Hashable]) -> None:
+        gate_name = cache_key[0] if cache_key is not None else None
+        for qubit_id in ids:
+            for channel in self.noise_model.channels(gate_name, qubit_id):
+                self.apply_channel(channel, qubit_id)
+
+    def apply_channel(self, channel: Channel, qubit_id: int) -> None:
+        # The probability of each Kraus operator only depends on the
+        # reduced density matrix of the qubit it acts on.
+        axis = self._axes[qubit_id]
+        others = [idx for idx in range(self.state.ndim) if idx != axis]
+        reduced = np.tensordot(
+            self.state, self.state.conj(), axes=(others, others)
+        )
+        probabilities = np.einsum(
+            "kij,jl,kil->k", channel, reduced, channel.conj()
+        ).real
+        probabilities = np.clip(probabilities, 0, None)
+        idx_kraus = self.rng.choice(
+            len(channel), p=probabilities / probabilities.sum()
+        )
+        _apply_1q(self.state, channel[idx_kraus], axis)
+        self.state /= np.sqrt(probabilities[idx_kraus])
+        self._known.pop(qubit_id, None)
+
+    def run_shots(self, program: Callable[[QuantumDevice], Any],
+                  shots: int) -> np.ndarray:
+        # Every shot needs its own trajectory, so replay the program each
+        # time rather than sampling from a single final state.
+        return QuantumDevice.run_shots(self, program, shots)
+
+if __name__ == "__main__":
+    from teleport import teleport
+
+    noise_model = NoiseModel(after_gate={
+        "cnot": [depolarizing(0.02)],
+        "h": [dephasing(0.01)]
+    })
+    angle = 0.123
+
+    sim = DensityMatrixSimulator(capacity=3, noise_model=noise_model)
+    n_errors = 0
+    n_runs = 200
+    for _ in range(n_runs):
+        with sim.using_register(3) as (msg, here, there):
+            msg.ry(angle)
+            teleport(msg, here, there)
+            there.ry(-angle)
+            n_errors += there.measure()
+    print(f"Density matrix simulation: {n_errors / n_runs:0.1%} teleportation errors.")
+
+    sim = TrajectorySimulator(capacity=3, noise_model=noise_model)
+    n_errors = 0
+    for _ in range(n_runs):
+        with sim.using_register(3) as (msg, here, there):
+            msg.ry(angle)
+            teleport(msg, here, there)
+            there.ry(-angle)
+            n_errors += there.measure()
+    print(f"Trajectory simulation:     {n_errors / n_runs:0.1%} teleportation errors.")
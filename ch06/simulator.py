@@ -11,16 +11,227 @@
 ##
 
 from interface import QuantumDevice, Qubit
+from circuit import Instruction, fuse
 import qutip as qt
-from qutip.qip.operations import (
-    hadamard_transform, gate_expand_1toN, gate_expand_2toN
-)
+from qutip.qip.operations import hadamard_transform
 import numpy as np
-from typing import List
+import scipy.sparse as sp
+import heapq
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Union
 
 KET_0 = qt.basis(2, 0)
 H = hadamard_transform()
 
+GATES = {
+    "h": lambda: H,
+    "x": qt.sigmax,
+    "y": qt.sigmay,
+    "z": qt.sigmaz,
+    "rx": qt.rx,
+    "ry": qt.ry,
+    "rz": qt.rz,
+    "cnot": qt.cnot,
+    "swap": qt.swap
+}
+
+class GateCache:
+    """
+    A least-recently-used cache of gate matrices, bounded by the total
+    number of bytes used by the cached matrices.
+
+    Keys identify a gate by name and parameters, and (for operators that
+    a backend expands to act on a whole register) by the qubits it acts
+    on and the size of the register. The `hits`, `misses` and `evictions`
+    counters show how well the cache is working.
+    """
+    max_bytes: int
+    n_bytes: int
+    hits: int
+    misses: int
+    evictions: int
+
+    def __init__(self, max_bytes: int = 64 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self.clear()
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.n_bytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+        self.misses += 1
+        value = factory()
+        size = _nbytes(value)
+        if size <= self.max_bytes:
+            self._entries[key] = (value, size)
+            self.n_bytes += size
+            while self.n_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.n_bytes -= evicted_size
+                self.evictions += 1
+        return value
+
+GATE_CACHE = GateCache()
+
+def _nbytes(value: Any) -> int:
+    if isinstance(value, qt.Qobj):
+        value = value.data
+    if hasattr(value, "indptr"):
+        return value.data.nbytes + value.indices.nbytes + value.indptr.nbytes
+    return np.asarray(value).nbytes
+
+def _as_matrix(unitary: Union[qt.Qobj, np.ndarray]) -> np.ndarray:
+    if isinstance(unitary, qt.Qobj):
+        return unitary.full()
+    return np.asarray(unitary, dtype=complex)
+
+def _cached_gate_matrix(gate_cache: "GateCache", name: str,
+                        *params: float) -> np.ndarray:
+    # Cached matrices are shared between every simulator that uses the
+    # same cache, so make sure that none of them can modify one in place
+    # by accident.
+    def make_matrix():
+        matrix = _as_matrix(GATES[name](*params))
+        matrix.flags.writeable = False
+        return matrix
+    return gate_cache.get((name, params), make_matrix)
+
+def _apply_1q(state: np.ndarray, matrix: np.ndarray, axis: int) -> None:
+    # Updates both halves of the register along `axis` in place, so that
+    # a single-qubit gate only ever touches 2^n amplitudes.
+    # The trailing Ellipsis keeps each slice a view, even when `axis` is
+    # the only axis of the register.
+    slice_0 = state[(slice(None),) * axis + (0, Ellipsis)]
+    slice_1 = state[(slice(None),) * axis + (1, Ellipsis)]
+    old_0 = slice_0.copy()
+    slice_0 *= matrix[0, 0]
+    slice_0 += matrix[0, 1] * slice_1
+    slice_1 *= matrix[1, 1]
+    slice_1 += matrix[1, 0] * old_0
+
+def _apply_kq(state: np.ndarray, matrix: np.ndarray,
+              axes: Sequence[int]) -> np.ndarray:
+    # Contracts a k-qubit gate, reshaped into a (2,) * 2k tensor, against
+    # only the axes it acts on, then moves the output axes back into place.
+    n_targets = len(axes)
+    gate = matrix.reshape((2,) * (2 * n_targets))
+    new_state = np.tensordot(
+        gate, state,
+        axes=(list(range(n_targets, 2 * n_targets)), list(axes))
+    )
+    return np.ascontiguousarray(
+        np.moveaxis(new_state, list(range(n_targets)), list(axes))
+    )
+
+def _kron_chain(factors: dict, capacity: int) -> sp.csr_matrix:
+    # Builds the Kronecker product of the given single-qubit factors with
+    # identities on every other qubit, merging runs of untouched qubits
+    # into a single identity so that the chain stays short.
+    operator = sp.identity(1, dtype=complex, format="csr")
+    n_identities = 0
+    for qubit_id in range(capacity):
+        if qubit_id in factors:
+            if n_identities:
+                operator = sp.kron(
+                    operator, sp.identity(2 ** n_identities), format="csr"
+                )
+                n_identities = 0
+            operator = sp.kron(operator, factors[qubit_id], format="csr")
+        else:
+            n_identities += 1
+    if n_identities:
+        operator = sp.kron(
+            operator, sp.identity(2 ** n_identities), format="csr"
+        )
+    return operator
+
+def _expand_sparse(matrix: np.ndarray, ids: Sequence[int],
+                   capacity: int) -> sp.csr_matrix:
+    # Writes the gate as a sum of products of matrix units |a⟩⟨b| on each
+    # target qubit, so that every term is a Kronecker product with
+    # identities. This works whatever the order of the target qubits, and
+    # each nonzero entry of the gate contributes only 2^(n - k) nonzeros.
+    n_targets = len(ids)
+    blocks = matrix.reshape((2,) * (2 * n_targets))
+    operator = sp.csr_matrix((2 ** capacity, 2 ** capacity), dtype=complex)
+    for index in zip(*np.nonzero(blocks)):
+        factors = {}
+        for qubit_id, row, col in zip(
+            ids, index[:n_targets], index[n_targets:]
+        ):
+            factors[qubit_id] = sp.csr_matrix(
+                ([1], ([row], [col])), shape=(2, 2), dtype=complex
+            )
+        operator = operator + blocks[index] * _kron_chain(factors, capacity)
+    return operator.tocsr()
+
+class UniformSource:
+    """
+    Hands out uniform random numbers one at a time from blocks drawn all
+    at once from a NumPy Generator, rather than calling into the Generator
+    once per measurement.
+
+    The first block is small, and each block after it is twice as large
+    as the last, up to `block_size`, so that short-lived devices which
+    only measure a few times don't pay for a full block.
+    """
+    rng: np.random.Generator
+    block_size: int
+
+    def __init__(self, rng: Optional[np.random.Generator] = None,
+                 block_size: int = 1024, initial_block_size: int = 4):
+        self.rng = np.random.default_rng(rng)
+        self.block_size = block_size
+        self._next_size = min(initial_block_size, block_size)
+        self._block = np.empty(0)
+        self._idx = 0
+
+    def random(self) -> float:
+        if self._idx == len(self._block):
+            self._block = self.rng.random(self._next_size)
+            self._next_size = min(2 * self._next_size, self.block_size)
+            self._idx = 0
+        self._idx += 1
+        return float(self._block[self._idx - 1])
+
+class _NonTerminalMeasurement(Exception):
+    """
+    Raised while running shots when a program uses a measurement result,
+    or touches a measured qubit, before the end of the program.
+    """
+
+class _DeferredResult:
+    """
+    Stands in for the result of a measurement that has not been sampled
+    yet; any attempt to use its value means that the measurement was not
+    terminal after all.
+    """
+    def __init__(self, index: int):
+        self.index = index
+
+    def _not_terminal(self, *args):
+        raise _NonTerminalMeasurement()
+
+    __bool__ = __int__ = __index__ = _not_terminal
+    __eq__ = __ne__ = _not_terminal
+    __and__ = __rand__ = __or__ = __ror__ = __xor__ = __rxor__ = _not_terminal
+    __float__ = __invert__ = __neg__ = _not_terminal
+    __add__ = __radd__ = __sub__ = __rsub__ = __mul__ = __rmul__ = _not_terminal
+    __lt__ = __le__ = __gt__ = __ge__ = _not_terminal
+    __hash__ = object.__hash__
+
 class SimulatedQubit(Qubit):
     qubit_id: int
     parent: "Simulator"
@@ -29,106 +240,499 @@ class SimulatedQubit(Qubit):
         self.qubit_id = id
         self.parent = parent_simulator
 
+    def __lt__(self, other: "SimulatedQubit") -> bool:
+        # Lets the simulator keep its free qubits in a heap, so that the
+        # lowest-numbered free qubit is always allocated first.
+        return self.qubit_id < other.qubit_id
+
     def h(self) -> None:
-        self.parent._apply(H, [self.qubit_id])
+        self.parent._apply_gate("h", [self.qubit_id])
 
     def measure(self) -> bool:
-        projectors = [
-            gate_expand_1toN(
-                qt.basis(2, outcome) * qt.basis(2, outcome).dag(),
-                self.parent.capacity,
-                self.qubit_id
-            )
-            for outcome in (0, 1)
-        ]
-        post_measurement_states = [
-            projector * self.parent.register_state
-            for projector in projectors
-        ]
-        probabilities = [
-            post_measurement_state.norm() ** 2
-            for post_measurement_state in post_measurement_states
-        ]
-        sample = np.random.choice([0, 1], p=probabilities)
-        self.parent.register_state = post_measurement_states[sample].unit()
-        return int(sample)
+        return self.parent._measure(self.qubit_id)
 
     def reset(self) -> None:
-        if self.measure(): self.x()
+        self.parent._reset(self.qubit_id)
 
     def swap(self, target: Qubit) -> None:
-        self.parent._apply(
-            qt.swap(),
-            [self.qubit_id, target.qubit_id]
-        )
+        self.parent._apply_gate("swap", [self.qubit_id, target.qubit_id])
 
     def cnot(self, target: Qubit) -> None:
-        self.parent._apply(
-            qt.cnot(),
-            [self.qubit_id, target.qubit_id]
-        )
+        self.parent._apply_gate("cnot", [self.qubit_id, target.qubit_id])
 
     def rx(self, theta: float) -> None:
-        self.parent._apply(qt.rx(theta), [self.qubit_id])
+        self.parent._apply_gate("rx", [self.qubit_id], theta)
 
     def ry(self, theta: float) -> None:
-        self.parent._apply(qt.ry(theta), [self.qubit_id])
+        self.parent._apply_gate("ry", [self.qubit_id], theta)
 
     def rz(self, theta: float) -> None:
-        self.parent._apply(qt.rz(theta), [self.qubit_id])
+        self.parent._apply_gate("rz", [self.qubit_id], theta)
 
     def x(self) -> None:
-        self.parent._apply(qt.sigmax(), [self.qubit_id])
+        self.parent._apply_gate("x", [self.qubit_id])
 
     def y(self) -> None:
-        self.parent._apply(qt.sigmay(), [self.qubit_id])
+        self.parent._apply_gate("y", [self.qubit_id])
 
     def z(self) -> None:
-        self.parent._apply(qt.sigmaz(), [self.qubit_id])
+        self.parent._apply_gate("z", [self.qubit_id])
+
+    def ccnot(self, control: Qubit, target: Qubit) -> None:
+        self.parent._apply_controlled(
+            "x", [self.qubit_id, control.qubit_id], [target.qubit_id]
+        )
+
+    def controlled(self, name: str, controls: Sequence[Qubit],
+                   *params: float) -> None:
+        # Applies the named gate to this qubit only where every one of
+        # `controls` is in |1⟩, as in `qubit.controlled("z", others)`.
+        self.parent._apply_controlled(
+            name, [control.qubit_id for control in controls],
+            [self.qubit_id], *params
+        )
 
 class Simulator(QuantumDevice):
     capacity: int
     available_qubits: List[SimulatedQubit]
-    register_state: qt.Qobj
-    def __init__(self, capacity=3):
+    state: np.ndarray
+    backend: str
+    dynamic: bool
+    gate_cache: GateCache
+    rng: np.random.Generator
+    gates_recorded: int
+    gates_applied: int
+    measurements_skipped: int
+    resets_skipped: int
+    _deferred: Optional[List[int]]
+    _known: Dict[int, int]
+    _axes: Dict[int, int]
+    _circuit: Optional[List[Instruction]]
+    def __init__(self, capacity=3, backend: str = "dense",
+                 gate_cache: Optional[GateCache] = None,
+                 dynamic: bool = False,
+                 rng: Optional[np.random.Generator] = None):
+        if backend not in ("dense", "sparse"):
+            raise ValueError(f"Unknown simulator backend: {backend!r}.")
         self.capacity = capacity
+        self.backend = backend
+        self.dynamic = dynamic
+        self.gate_cache = GATE_CACHE if gate_cache is None else gate_cache
+        self._uniforms = UniformSource(rng)
+        self.rng = self._uniforms.rng
+        self._deferred = None
+        self._circuit = None
+        self.gates_recorded = self.gates_applied = 0
+        self.measurements_skipped = self.resets_skipped = 0
         self.available_qubits = [
             SimulatedQubit(self, idx)
             for idx in range(capacity)
         ]
-        self._sort_available()
-        self.register_state = qt.tensor(
-            *[
-                qt.basis(2, 0)
-                for _ in range(capacity)
-            ]
+        heapq.heapify(self.available_qubits)
+        # The register is kept as a (2,) * n tensor, with one axis per live
+        # qubit. By default, every qubit is live from the start, and qubit i
+        # is axis i, the same order as qt.tensor would use. A dynamic
+        # simulator instead starts with no qubits at all, adds an axis for
+        # each qubit as it is allocated, and removes it again once the
+        # qubit is released in |0⟩, so its axes follow the order in which
+        # qubits were allocated; register_state puts them back in order of
+        # qubit id.
+        n_live = 0 if dynamic else capacity
+        self._axes = {idx: idx for idx in range(n_live)}
+        self.state = np.zeros((2,) * n_live, dtype=complex)
+        self.state[(0,) * n_live] = 1
+        # Qubits that are known to be in a computational basis state,
+        # unentangled with the rest of the register, mapped to the value
+        # that measuring them would give.
+        self._known = {idx: 0 for idx in range(capacity)}
+
+    def _id_order_axes(self) -> List[int]:
+        # The axis of each live qubit, in increasing order of qubit id.
+        return [self._axes[qubit_id] for qubit_id in sorted(self._axes)]
+
+    @property
+    def register_state(self) -> qt.Qobj:
+        # Live qubits appear in increasing order of qubit id, whatever the
+        # order of the axes of self.state.
+        self.flush()
+        return qt.Qobj(
+            np.transpose(self.state, self._id_order_axes()).reshape((-1, 1)),
+            dims=[[2] * self.state.ndim, [1] * self.state.ndim]
         )
-    def _sort_available(self) -> None:
-        self.available_qubits = list(sorted(
-            self.available_qubits,
-            key=lambda qubit: qubit.qubit_id,
-            reverse=True
-        ))
+
+    @register_state.setter
+    def register_state(self, new_state: Union[qt.Qobj, np.ndarray]) -> None:
+        self.flush()
+        new_state = np.array(
+            _as_matrix(new_state), dtype=complex
+        ).reshape((2,) * self.state.ndim)
+        self.state = np.moveaxis(
+            new_state, range(self.state.ndim), self._id_order_axes()
+        ).copy()
+        self._known = {}
+
+    @property
+    def n_live_qubits(self) -> int:
+        return self.state.ndim
 
     def allocate_qubit(self) -> SimulatedQubit:
         if self.available_qubits:
-            return self.available_qubits.pop()
+            qubit = heapq.heappop(self.available_qubits)
+            if self._deferred is not None and qubit.qubit_id in self._deferred:
+                raise _NonTerminalMeasurement()
+            if qubit.qubit_id not in self._axes:
+                self._grow(qubit.qubit_id)
+            return qubit
 
     def deallocate_qubit(self, qubit: SimulatedQubit):
-        self.available_qubits.append(qubit)
-        self._sort_available()
-
-    def _apply(self, unitary: qt.Qobj, ids: List[int]):
-        if len(ids) == 1:
-            matrix = gate_expand_1toN(unitary,
-                                                 self.capacity, ids[0])
-        elif len(ids) == 2:
-            matrix = gate_expand_2toN(unitary,
-                                                 self.capacity, *ids)
+        heapq.heappush(self.available_qubits, qubit)
+        # While run_shots is deferring measurements, a measured qubit's
+        # axis is still needed for sampling, so run_shots shrinks it
+        # afterwards instead.
+        deferred = self._deferred is not None and qubit.qubit_id in self._deferred
+        if self.dynamic and not deferred and self._known.get(qubit.qubit_id) == 0:
+            self._shrink(qubit.qubit_id)
+
+    def _grow(self, qubit_id: int) -> None:
+        # Tensors |0⟩ onto the end of the register.
+        self.flush()
+        self.state = np.stack(
+            [self.state, np.zeros_like(self.state)], axis=-1
+        )
+        self._axes[qubit_id] = self.state.ndim - 1
+        self._known[qubit_id] = 0
+
+    def _shrink(self, qubit_id: int) -> None:
+        # A qubit known to be in |0⟩ is not entangled with anything else,
+        # so tracing it out is just taking the slice where it is 0.
+        self.flush()
+        axis = self._axes.pop(qubit_id)
+        self.state = self.state[(slice(None),) * axis + (0,)].copy()
+        for other_id, other_axis in self._axes.items():
+            if other_axis > axis:
+                self._axes[other_id] = other_axis - 1
+
+    def _apply(self, unitary: Union[qt.Qobj, np.ndarray], ids: List[int],
+               cache_key: Optional[Hashable] = None):
+        if self._deferred is not None and any(
+            qubit_id in self._deferred for qubit_id in ids
+        ):
+            raise _NonTerminalMeasurement()
+        matrix = _as_matrix(unitary)
+        if matrix.shape != (2 ** len(ids),) * 2:
+            raise ValueError(
+                f"A {matrix.shape} matrix can't act on {len(ids)} qubit(s)."
+            )
+        if len(set(ids)) != len(ids):
+            raise ValueError(f"A gate can't act on the same qubit twice: {ids}.")
+
+        self._update_known(ids, cache_key)
+        if self._circuit is not None:
+            self._circuit.append(Instruction(matrix, tuple(ids), cache_key))
+            self.gates_recorded += 1
+        else:
+            self._apply_now(matrix, ids, cache_key)
+
+    def _apply_now(self, matrix: np.ndarray, ids: Sequence[int],
+                   cache_key: Optional[Hashable] = None):
+        self.gates_applied += 1
+        axes = [self._axes[qubit_id] for qubit_id in ids]
+        n_live = self.state.ndim
+        if self.backend == "sparse":
+            # The expanded operator only depends on the gate, the qubits it
+            # acts on and the size of the register, so when the gate has a
+            # name it can be cached alongside the gate matrix itself.
+            expand = lambda: _expand_sparse(matrix, axes, n_live)
+            operator = (
+                expand() if cache_key is None
+                else self.gate_cache.get(
+                    (cache_key, tuple(axes), n_live), expand
+                )
+            )
+            self.state = (operator @ self.state.reshape(-1)).reshape(
+                (2,) * n_live
+            )
+        elif len(axes) == 1:
+            _apply_1q(self.state, matrix, axes[0])
+        else:
+            self.state = _apply_kq(self.state, matrix, axes)
+        self._after_gate(ids, cache_key)
+
+    def _update_known(self, ids: Sequence[int],
+                      cache_key: Optional[Hashable]) -> None:
+        # X maps basis states to basis states, and diagonal gates only add
+        # a phase; anything else may leave the qubits in superposition.
+        name = cache_key[0] if cache_key is not None else None
+        for qubit_id in ids:
+            if qubit_id not in self._known:
+                continue
+            if name == "x":
+                self._known[qubit_id] ^= 1
+            elif name not in ("z", "rz"):
+                del self._known[qubit_id]
+
+    @contextmanager
+    def recording(self):
+        """
+        Records gates applied within this block instead of applying them
+        right away. Recorded gates are fused together (see circuit.fuse)
+        and applied whenever the state is next needed, such as for a
+        measurement.
+        """
+        outer = self._circuit
+        if outer is None:
+            self._circuit = []
+        try:
+            yield
+        finally:
+            if outer is None:
+                self.flush()
+                self._circuit = None
+
+    def flush(self) -> None:
+        if self._circuit:
+            instructions = fuse(self._circuit)
+            self._circuit.clear()
+            for instruction in instructions:
+                self._apply_now(*instruction)
+
+    def apply_unitary(self, unitary: Union[qt.Qobj, np.ndarray],
+                      qubits: Sequence[SimulatedQubit]) -> None:
+        """
+        Applies a 2^k × 2^k unitary to k qubits, with the first qubit
+        given corresponding to the leftmost factor of the matrix.
+        """
+        self._apply(unitary, [qubit.qubit_id for qubit in qubits])
+
+    def _apply_controlled(self, name: str, controls: Sequence[int],
+                          targets: Sequence[int], *params: float) -> None:
+        """
+        Applies the named gate to `targets`, conditioned on every qubit in
+        `controls` being in |1⟩. Only the slice of the register where all
+        of the controls are 1 is read or written, so with c controls, the
+        gate costs one pass over 2^(n - c) amplitudes whatever the number
+        of controls.
+        """
+        ids = list(controls) + list(targets)
+        if len(set(ids)) != len(ids):
+            raise ValueError(f"A gate can't act on the same qubit twice: {ids}.")
+        if self._deferred is not None and any(
+            qubit_id in self._deferred for qubit_id in ids
+        ):
+            raise _NonTerminalMeasurement()
+        matrix = self._gate_matrix(name, *params)
+        cache_key = (name, params)
+
+        # A control known to be 0 turns the whole gate off, and one known
+        # to be 1 can be dropped.
+        if any(self._known.get(qubit_id) == 0 for qubit_id in controls):
+            self._after_gate(ids, cache_key)
+            return
+        controls = [
+            qubit_id for qubit_id in controls if self._known.get(qubit_id) != 1
+        ]
+        if controls:
+            for qubit_id in targets:
+                if qubit_id in self._known and name not in ("z", "rz"):
+                    del self._known[qubit_id]
+        else:
+            self._update_known(targets, cache_key)
+
+        # The slice is taken with basic indexing, so it is a view into the
+        # register, and works the same way for either backend.
+        self.flush()
+        self.gates_applied += 1
+        control_axes = [self._axes[qubit_id] for qubit_id in controls]
+        index = [slice(None)] * self.state.ndim
+        for axis in control_axes:
+            index[axis] = 1
+        index = tuple(index) + (Ellipsis,)
+        target_axes = [
+            axis - sum(control_axis < axis for control_axis in control_axes)
+            for axis in (self._axes[qubit_id] for qubit_id in targets)
+        ]
+        block = self.state[index]
+        if len(target_axes) == 1:
+            _apply_1q(block, matrix, target_axes[0])
         else:
-            raise ValueError("Only one- or two-qubit unitary matrices supported.")
+            self.state[index] = _apply_kq(block, matrix, target_axes)
+        self._after_gate(ids, cache_key)
 
-        self.register_state = matrix * self.register_state
+    def _after_gate(self, ids: Sequence[int],
+                    cache_key: Optional[Hashable]) -> None:
+        # Called once each gate has been applied; subclasses can override
+        # this to model what happens to the qubits afterwards, such as
+        # noise.
+        pass
+
+    def _gate_matrix(self, name: str, *params: float) -> np.ndarray:
+        return _cached_gate_matrix(self.gate_cache, name, *params)
+
+    def _apply_gate(self, name: str, ids: List[int], *params: float):
+        self._apply(self._gate_matrix(name, *params), ids, (name, params))
+
+    def _measure(self, qubit_id: int) -> Union[int, _DeferredResult]:
+        if self._deferred is not None:
+            if qubit_id not in self._deferred:
+                self._deferred.append(qubit_id)
+            return _DeferredResult(self._deferred.index(qubit_id))
+        if qubit_id in self._known:
+            self.measurements_skipped += 1
+            return self._known[qubit_id]
+
+        # The marginal probability of a 1 is the total weight of the slice
+        # along this qubit's axis; collapsing zeros the other slice and
+        # renormalizes the register in place.
+        self.flush()
+        axis = self._axes[qubit_id]
+        slice_1 = self.state[(slice(None),) * axis + (1,)]
+        pr1 = np.vdot(slice_1, slice_1).real
+        sample = int(self._uniforms.random() < pr1)
+
+        self.state[(slice(None),) * axis + (1 - sample,)] = 0
+        self.state /= np.sqrt(pr1 if sample else 1 - pr1)
+        self._known[qubit_id] = sample
+        return sample
+
+    def _reset(self, qubit_id: int) -> None:
+        if self._known.get(qubit_id) == 0:
+            self.resets_skipped += 1
+            return
+        if self._deferred is not None:
+            # Qubits that have already had their terminal measurement are
+            # reset once the shots have been sampled; resetting any other
+            # qubit is itself a mid-circuit measurement.
+            if qubit_id in self._deferred:
+                return
+            raise _NonTerminalMeasurement()
+        if self._measure(qubit_id):
+            self._apply_gate("x", [qubit_id])
+
+    def _marginal(self, ids: List[int]) -> np.ndarray:
+        self.flush()
+        axes = [self._axes[qubit_id] for qubit_id in ids]
+        others = tuple(
+            axis for axis in range(self.state.ndim) if axis not in axes
+        )
+        marginal = np.sum(np.abs(self.state) ** 2, axis=others)
+        # np.sum keeps the remaining axes in register order, so move them
+        # into the order in which the qubits were passed before flattening.
+        marginal = np.transpose(marginal, np.argsort(np.argsort(axes)))
+        probabilities = marginal.reshape(-1)
+        return probabilities / probabilities.sum()
+
+    def measure_many(self, qubits: List[SimulatedQubit]) -> List[int]:
+        if self._deferred is not None or all(
+            qubit.qubit_id in self._known for qubit in qubits
+        ):
+            return [self._measure(qubit.qubit_id) for qubit in qubits]
+        ids = [qubit.qubit_id for qubit in qubits]
+        probabilities = self._marginal(ids)
+        sample = self.rng.choice(len(probabilities), p=probabilities)
+        outcomes = np.unravel_index(sample, (2,) * len(ids))
+
+        index = [slice(None)] * self.state.ndim
+        for qubit_id, outcome in zip(ids, outcomes):
+            index[self._axes[qubit_id]] = outcome
+        index = tuple(index)
+        collapsed = self.state[index] / np.sqrt(probabilities[sample])
+        self.state[...] = 0
+        self.state[index] = collapsed
+        for qubit_id, outcome in zip(ids, outcomes):
+            self._known[qubit_id] = int(outcome)
+        return [int(outcome) for outcome in outcomes]
+
+    def sample(self, qubits: List[SimulatedQubit], shots: int) -> np.ndarray:
+        """
+        Draws `shots` joint measurement outcomes for `qubits` without
+        collapsing the register, returning an array of shape
+        (shots, len(qubits)).
+        """
+        ids = [qubit.qubit_id for qubit in qubits]
+        probabilities = self._marginal(ids)
+        samples = self.rng.choice(len(probabilities), size=shots, p=probabilities)
+        shifts = np.arange(len(ids) - 1, -1, -1)
+        return (samples[:, np.newaxis] >> shifts) & 1
+
+    def run_shots(self, program: Callable[[QuantumDevice], Any],
+                  shots: int) -> np.ndarray:
+        # Run the program once, deferring its measurements. If they all
+        # turn out to be terminal, the distribution over their outcomes is
+        # fixed, and every shot can be drawn from it at once. Otherwise,
+        # put the device back the way it was and replay the program.
+        self.flush()
+        saved_state = self.state.copy()
+        saved_axes = dict(self._axes)
+        saved_known = dict(self._known)
+        saved_available = list(self.available_qubits)
+        self._deferred = []
+
+        def restore():
+            self._deferred = None
+            if self._circuit is not None:
+                self._circuit.clear()
+            self.state = saved_state
+            self._axes = saved_axes
+            self._known = saved_known
+            self.available_qubits = saved_available
+
+        try:
+            results = program(self)
+        except _NonTerminalMeasurement:
+            results = None
+        except BaseException:
+            # Any other error is the program's own.
+            restore()
+            raise
+
+        # Programs that return anything other than their deferred
+        # measurements (a constant, say) are replayed shot by shot like
+        # any other program.
+        if isinstance(results, _DeferredResult):
+            columns = results.index
+        elif isinstance(results, (list, tuple)) and all(
+            isinstance(result, _DeferredResult) for result in results
+        ):
+            columns = [result.index for result in results]
+        else:
+            restore()
+            return super().run_shots(program, shots)
+
+        measured_ids, self._deferred = self._deferred, None
+        samples = self.sample(
+            [SimulatedQubit(self, qubit_id) for qubit_id in measured_ids],
+            shots
+        )
+        for qubit_id in measured_ids:
+            self._reset(qubit_id)
+        if self.dynamic:
+            for qubit in self.available_qubits:
+                if qubit.qubit_id in self._axes and self._known.get(qubit.qubit_id) == 0:
+                    self._shrink(qubit.qubit_id)
+        return samples[:, columns]
 
     def dump(self) -> None:
         print(self.register_state)
+
+if __name__ == "__main__":
+    def bell_pair(device: QuantumDevice):
+        with device.using_register(2) as (a, b):
+            a.h()
+            a.cnot(b)
+            return [a.measure(), b.measure()]
+
+    def one_superposed(device: QuantumDevice):
+        # b is still known to be |0⟩ when it is released, so a dynamic
+        # register would drop its axis if nothing held on to it.
+        with device.using_register(2) as (a, b):
+            a.h()
+            return [a.measure(), b.measure()]
+
+    for dynamic in (False, True):
+        for program in (bell_pair, one_superposed):
+            sim = Simulator(capacity=2, dynamic=dynamic)
+            samples = sim.run_shots(program, 1000)
+            print(f"{program.__name__} (dynamic={dynamic}): " \
+                  f"P(a = 1) = {samples[:, 0].mean():0.2f}, " \
+                  f"P(b = 1) = {samples[:, 1].mean():0.2f}, " \
+                  f"{sim.n_live_qubits} live qubit(s) afterwards.")
@@ -0,0 +1,386 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+##
+# stabilizer.py: Defines a simulator for Clifford-only programs, based on
+#     the stabilizer tableau of Aaronson and Gottesman (CHP), using the
+#     interface defined in interface.py.
+##
+# Copyright (c) Sarah Kaiser and Cassandra Granade.
+# Code sample from the book "Learn Quantum Computing with Python and Q#" by
+# Sarah Kaiser and Cassandra Granade, published by Manning Publications Co.
+# Book ISBN 9781617296130.
+# Code licensed under the MIT License.
+##
+
+from interface import QuantumDevice
+from simulator import SimulatedQubit, Simulator
+import heapq
+import numpy as np
+from typing import Any, Callable, List, Optional, Sequence, Union
+
+# Number of 1 bits in each possible byte.
+POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.int64)
+
+# Largest register that can be expanded into a state vector: 2^28 complex
+# amplitudes already take 4 GiB, and past 63 qubits the basis state
+# indices no longer fit in an int64.
+MAX_STATE_VECTOR_QUBITS = 28
+
+class NotCliffordError(ValueError):
+    """
+    Raised when a program applies a gate that a stabilizer simulator can't
+    represent.
+    """
+
+def _quarter_turns(theta: float) -> int:
+    # Rotations by multiples of π / 2 are Clifford gates; any other angle
+    # would take the state outside of the stabilizer formalism.
+    turns = theta / (np.pi / 2)
+    if not np.isclose(turns, np.round(turns)):
+        raise NotCliffordError(f"Rotation by {theta} is not a Clifford gate.")
+    return int(np.round(turns)) % 4
+
+class StabilizerSimulator(QuantumDevice):
+    """
+    Simulates Clifford programs (H, S, X, Y, Z, CNOT, SWAP, rotations by
+    multiples of π / 2, and measurement) in time and memory polynomial in
+    the number of qubits.
+
+    The state is tracked as a tableau of n destabilizer and n stabilizer
+    generators (plus one scratch row), with the X and Z parts of each
+    generator packed eight qubits to a byte, so that each gate is a few
+    bitwise operations on one column of bits and each measurement is a
+    handful of XORs of whole packed rows.
+    """
+    capacity: int
+    available_qubits: List[SimulatedQubit]
+    x: np.ndarray
+    z: np.ndarray
+    r: np.ndarray
+    rng: np.random.Generator
+
+    def __init__(self, capacity=3,
+                 rng: Optional[np.random.Generator] = None):
+        self.capacity = capacity
+        self.rng = np.random.default_rng(rng)
+        self.available_qubits = [
+            SimulatedQubit(self, idx)
+            for idx in range(capacity)
+        ]
+        heapq.heapify(self.available_qubits)
+
+        n_bytes = (capacity + 7) // 8
+        self.x = np.zeros((2 * capacity + 1, n_bytes), dtype=np.uint8)
+        self.z = np.zeros((2 * capacity + 1, n_bytes), dtype=np.uint8)
+        self.r = np.zeros(2 * capacity + 1, dtype=np.uint8)
+        # Destabilizer i starts as X on qubit i, and stabilizer i as Z.
+        identity = np.packbits(
+            np.eye(capacity, dtype=np.uint8), axis=1, bitorder="little"
+        )
+        self.x[:capacity] = identity
+        self.z[capacity:2 * capacity] = identity
+
+    def allocate_qubit(self) -> SimulatedQubit:
+        if self.available_qubits:
+            return heapq.heappop(self.available_qubits)
+
+    def deallocate_qubit(self, qubit: SimulatedQubit):
+        heapq.heappush(self.available_qubits, qubit)
+
+    def _column(self, bits: np.ndarray, qubit_id: int) -> np.ndarray:
+        return (bits[:, qubit_id >> 3] >> (qubit_id & 7)) & 1
+
+    def _flip(self, bits: np.ndarray, qubit_id: int, where: np.ndarray) -> None:
+        bits[:, qubit_id >> 3] ^= where.astype(np.uint8) << (qubit_id & 7)
+
+    def _h(self, a: int) -> None:
+        xa, za = self._column(self.x, a), self._column(self.z, a)
+        self.r ^= xa & za
+        self._flip(self.x, a, xa ^ za)
+        self._flip(self.z, a, xa ^ za)
+
+    def _s(self, a: int) -> None:
+        xa, za = self._column(self.x, a), self._column(self.z, a)
+        self.r ^= xa & za
+        self._flip(self.z, a, xa)
+
+    def _cnot(self, a: int, b: int) -> None:
+        xa, za = self._column(self.x, a), self._column(self.z, a)
+        xb, zb = self._column(self.x, b), self._column(self.z, b)
+        self.r ^= xa & zb & (xb ^ za ^ 1)
+        self._flip(self.x, b, xa)
+        self._flip(self.z, a, zb)
+
+    def _apply_gate(self, name: str, ids: List[int], *params: float):
+        if name == "h":
+            self._h(ids[0])
+        elif name == "x":
+            self.r ^= self._column(self.z, ids[0])
+        elif name == "y":
+            self.r ^= self._column(self.x, ids[0]) ^ self._column(self.z, ids[0])
+        elif name == "z":
+            self.r ^= self._column(self.x, ids[0])
+        elif name == "cnot":
+            self._cnot(*ids)
+        elif name == "swap":
+            self._cnot(*ids)
+            self._cnot(*reversed(ids))
+            self._cnot(*ids)
+        elif name in ("rx", "ry", "rz"):
+            # Up to a global phase, Rz(k π / 2) = S^k, Rx(θ) = H Rz(θ) H,
+            # and Ry(θ) = S Rx(θ) S†.
+            turns = _quarter_turns(*params)
+            if name == "ry":
+                for _ in range(3):
+                    self._s(ids[0])
+            if name != "rz":
+                self._h(ids[0])
+            for _ in range(turns):
+                self._s(ids[0])
+            if name != "rz":
+                self._h(ids[0])
+            if name == "ry":
+                self._s(ids[0])
+        else:
+            raise NotCliffordError(f"{name} is not a supported Clifford gate.")
+
+    def _apply_controlled(self, name: str, controls: Sequence[int],
+                          targets: Sequence[int], *params: float) -> None:
+        # With a single control, X and Z give CNOT and CZ, which are
+        # Clifford gates; every other controlled gate (such as CCNOT) is not.
+        ids = list(controls) + list(targets)
+        if len(set(ids)) != len(ids):
+            raise ValueError(f"A gate can't act on the same qubit twice: {ids}.")
+        if len(controls) != 1 or len(targets) != 1 or name not in ("x", "z"):
+            raise NotCliffordError(
+                f"{name} with {len(controls)} control(s) is not a supported Clifford gate."
+            )
+        if name == "z":
+            self._h(targets[0])
+        self._cnot(controls[0], targets[0])
+        if name == "z":
+            self._h(targets[0])
+
+    def _rowsum(self, targets: np.ndarray, source: int) -> None:
+        # Multiplies each target generator by the source generator in
+        # place. Working qubit by qubit, each product of Paulis contributes
+        # a phase of i^g with g in {-1, 0, 1}; the positions where g = +1
+        # and g = -1 are found with bitwise operations on the packed rows.
+        x1, z1 = self.x[source], self.z[source]
+        x2, z2 = self.x[targets], self.z[targets]
+        plus = (
+            (x1 & z1 & z2 & ~x2) |
+            (x1 & ~z1 & z2 & x2) |
+            (~x1 & z1 & x2 & ~z2)
+        )
+        minus = (
+            (x1 & z1 & x2 & ~z2) |
+            (x1 & ~z1 & z2 & ~x2) |
+            (~x1 & z1 & x2 & z2)
+        )
+        phase = (
+            2 * self.r[targets].astype(np.int64) + 2 * int(self.r[source]) +
+            POPCOUNT[plus].sum(axis=-1) - POPCOUNT[minus].sum(axis=-1)
+        )
+        self.r[targets] = np.mod(phase, 4) // 2
+        self.x[targets] ^= x1
+        self.z[targets] ^= z1
+
+    def _measure(self, qubit_id: int) -> int:
+        n = self.capacity
+        anticommuting = np.flatnonzero(self._column(self.x, qubit_id)[:2 * n])
+        stabilizers = anticommuting[anticommuting >= n]
+
+        if len(stabilizers):
+            # Some stabilizer anticommutes with Z on this qubit, so the
+            # outcome is uniformly random.
+            p = stabilizers[0]
+            self._rowsum(anticommuting[anticommuting != p], p)
+            self.x[p - n], self.z[p - n], self.r[p - n] = (
+                self.x[p], self.z[p], self.r[p]
+            )
+            self.x[p] = 0
+            self.z[p] = 0
+            self._flip(self.z[p:p + 1], qubit_id, np.ones(1, dtype=np.uint8))
+            self.r[p] = self.rng.integers(2)
+            return int(self.r[p])
+
+        # Otherwise the outcome is determined, and is the sign of the
+        # product of the stabilizers paired with the anticommuting
+        # destabilizers.
+        scratch = 2 * n
+        self.x[scratch] = 0
+        self.z[scratch] = 0
+        self.r[scratch] = 0
+        for idx in anticommuting:
+            self._rowsum(np.array([scratch]), idx + n)
+        return int(self.r[scratch])
+
+    def _reset(self, qubit_id: int) -> None:
+        if self._measure(qubit_id):
+            self._apply_gate("x", [qubit_id])
+
+    def stabilizers(self) -> List[str]:
+        n = self.capacity
+        xs = np.unpackbits(self.x[n:2 * n], axis=1, count=n, bitorder="little")
+        zs = np.unpackbits(self.z[n:2 * n], axis=1, count=n, bitorder="little")
+        return [
+            ("-" if sign else "+") + "".join("IXZY"[x + 2 * z] for x, z in zip(x_row, z_row))
+            for sign, x_row, z_row in zip(self.r[n:2 * n], xs, zs)
+        ]
+
+    def state_vector(self) -> np.ndarray:
+        """
+        Returns the register as a (2,) * n state vector, with qubit i on
+        axis i as in Simulator. Raises ValueError for registers of more
+        than MAX_STATE_VECTOR_QUBITS qubits.
+        """
+        n = self.capacity
+        if n > MAX_STATE_VECTOR_QUBITS:
+            raise ValueError(
+                f"Can't expand a {n}-qubit register into a state vector; "
+                f"at most {MAX_STATE_VECTOR_QUBITS} qubits are supported."
+            )
+        xs = np.unpackbits(self.x[n:2 * n], axis=1, count=n, bitorder="little")
+        zs = np.unpackbits(self.z[n:2 * n], axis=1, count=n, bitorder="little")
+        # Qubit 0 is the most significant bit of each basis state's index.
+        weights = 1 << np.arange(n - 1, -1, -1, dtype=np.int64)
+        indices = np.arange(2 ** n, dtype=np.int64)
+
+        # The stabilizer state is what is left of any vector that overlaps
+        # it after projecting onto the +1 eigenspace of every generator,
+        # and a fixed vector of generic phases overlaps every state.
+        state = np.exp(2j * np.pi * np.sqrt(2) * indices)
+        for sign, x_row, z_row in zip(self.r[n:2 * n], xs, zs):
+            x_mask, z_mask = int(x_row @ weights), int(z_row @ weights)
+            # X^x Z^z, with a factor of i for each Y, up to the sign.
+            phase = 1j ** int(np.sum(x_row & z_row)) * (-1) ** int(sign)
+            parity = indices & z_mask
+            for shift in (32, 16, 8, 4, 2, 1):
+                parity ^= parity >> shift
+            image = np.empty_like(state)
+            image[indices ^ x_mask] = phase * (1 - 2 * (parity & 1)) * state
+            state = (state + image) / 2
+        state /= np.linalg.norm(state)
+        return state.reshape((2,) * n)
+
+    def dump(self) -> None:
+        print("\n".join(self.stabilizers()))
+
+class CliffordFirstSimulator(QuantumDevice):
+    """
+    Runs a program on a StabilizerSimulator for as long as it only uses
+    Clifford gates. At the first gate that the tableau can't represent,
+    the stabilizer state is expanded into a state vector and handed to a
+    Simulator, which runs the rest of the program from there. Each gate
+    and measurement happens exactly once, however far into the program
+    the switch comes.
+    """
+    capacity: int
+    available_qubits: List[SimulatedQubit]
+    backend: Union[StabilizerSimulator, Simulator]
+    rng: np.random.Generator
+
+    def __init__(self, capacity=3,
+                 rng: Optional[np.random.Generator] = None):
+        self.capacity = capacity
+        self.backend = StabilizerSimulator(capacity, rng=rng)
+        self.rng = self.backend.rng
+        self.available_qubits = [
+            SimulatedQubit(self, idx)
+            for idx in range(capacity)
+        ]
+        heapq.heapify(self.available_qubits)
+
+    @property
+    def is_clifford(self) -> bool:
+        return isinstance(self.backend, StabilizerSimulator)
+
+    def allocate_qubit(self) -> SimulatedQubit:
+        if self.available_qubits:
+            return heapq.heappop(self.available_qubits)
+
+    def deallocate_qubit(self, qubit: SimulatedQubit):
+        heapq.heappush(self.available_qubits, qubit)
+
+    def _switch_to_state_vector(self) -> None:
+        if self.capacity > MAX_STATE_VECTOR_QUBITS:
+            raise ValueError(
+                f"This program applies a non-Clifford gate, which needs a "
+                f"state vector of 2^{self.capacity} amplitudes; only "
+                f"registers of up to {MAX_STATE_VECTOR_QUBITS} qubits can "
+                f"leave the stabilizer simulator."
+            )
+        # Both simulators draw from the same generator, so switching
+        # doesn't repeat or skip any random numbers.
+        simulator = Simulator(self.capacity, rng=self.rng)
+        simulator.register_state = self.backend.state_vector().reshape(-1)
+        self.backend = simulator
+
+    def _apply_gate(self, name: str, ids: List[int], *params: float):
+        if self.is_clifford:
+            try:
+                return self.backend._apply_gate(name, ids, *params)
+            except NotCliffordError:
+                self._switch_to_state_vector()
+        self.backend._apply_gate(name, ids, *params)
+
+    def _apply_controlled(self, name: str, controls: Sequence[int],
+                          targets: Sequence[int], *params: float) -> None:
+        if self.is_clifford:
+            try:
+                return self.backend._apply_controlled(
+                    name, controls, targets, *params
+                )
+            except NotCliffordError:
+                self._switch_to_state_vector()
+        self.backend._apply_controlled(name, controls, targets, *params)
+
+    def apply_unitary(self, unitary, qubits: Sequence[SimulatedQubit]) -> None:
+        # An arbitrary unitary can't be checked for being Clifford cheaply,
+        # so it always moves the program onto the state vector simulator.
+        if self.is_clifford:
+            self._switch_to_state_vector()
+        self.backend._apply(unitary, [qubit.qubit_id for qubit in qubits])
+
+    def _measure(self, qubit_id: int) -> int:
+        return self.backend._measure(qubit_id)
+
+    def _reset(self, qubit_id: int) -> None:
+        self.backend._reset(qubit_id)
+
+    def dump(self) -> None:
+        self.backend.dump()
+
+def run_program(program: Callable[[QuantumDevice], Any], capacity: int,
+                rng: Optional[np.random.Generator] = None) -> Any:
+    """
+    Runs `program` once on a CliffordFirstSimulator: on the stabilizer
+    simulator for as long as it only uses Clifford gates, and on the state
+    vector simulator from its first non-Clifford gate onwards.
+    """
+    return program(CliffordFirstSimulator(capacity, rng=rng))
+
+if __name__ == "__main__":
+    import time
+    from teleport import teleport
+
+    sim = StabilizerSimulator(capacity=3)
+    with sim.using_register(3) as (msg, here, there):
+        msg.h()
+        teleport(msg, here, there)
+        sim.dump()
+        there.h()
+        print(f"Teleported |+⟩ and measured {there.measure()} in the X basis.")
+
+    n_pairs = 2000
+    sim = StabilizerSimulator(capacity=2 * n_pairs)
+    start = time.perf_counter()
+    with sim.using_register(2 * n_pairs) as qubits:
+        for left, right in zip(qubits[::2], qubits[1::2]):
+            left.h()
+            left.cnot(right)
+        results = [qubit.measure() for qubit in qubits]
+    elapsed = time.perf_counter() - start
+    agree = all(a == b for a, b in zip(results[::2], results[1::2]))
+    print(f"Prepared and measured {n_pairs} Bell pairs in {elapsed:0.2f} s; outcomes agree: {agree}.")
@@ -13,7 +13,7 @@
 import qsharp
 from PhaseEstimation import RunGame, RunGameUsingControlledRotations
 
-from typing import Any
+from typing import Any, Optional
 import scipy.optimize as optimization
 import numpy as np
 
@@ -21,9 +21,11 @@ BIGGEST_ANGLE = 2 * np.pi
 
 def run_game_at_scales(scales: np.ndarray,
                        n_measurements_per_scale: int = 100,
-                       control: bool = False
+                       control: bool = False,
+                       rng: Optional[np.random.Generator] = None
     ) -> Any:
-    hidden_angle = np.random.random() * BIGGEST_ANGLE
+    rng = np.random.default_rng(rng)
+    hidden_angle = rng.random() * BIGGEST_ANGLE
     print(f"Pssst the hidden angle is {hidden_angle}, good luck!")
     return (
         RunGameUsingControlledRotations
@@ -0,0 +1,206 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+##
+# grover.py: Simulates Grover's search (as in operations.qs) in Python,
+#     acting on the amplitudes of the register directly rather than
+#     applying gates, so that large searches can be run without Q#.
+##
+# Copyright (c) Sarah Kaiser and Cassandra Granade.
+# Code sample from the book "Learn Quantum Computing with Python and Q#" by
+# Sarah Kaiser and Cassandra Granade, published by Manning Publications Co.
+# Book ISBN 9781617296130.
+# Code licensed under the MIT License.
+##
+
+import time
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple, Union
+import numpy as np
+
+# Number of amplitudes handled at a time when sampling, so that sampling
+# never needs a second array the size of the whole register.
+CHUNK_SIZE = 1 << 20
+
+def n_iterations(n_qubits: int, n_marked: int = 1) -> int:
+    # Same as NIterations in operations.qs, which assumes that one item is
+    # marked.
+    angle = np.arcsin(np.sqrt(n_marked / 2 ** n_qubits))
+    return int(np.round(0.25 * np.pi / angle - 0.5))
+
+def success_probability(n_qubits: int, n_iterations: Union[int, np.ndarray],
+                        n_marked: int = 1) -> Union[float, np.ndarray]:
+    # Each iteration rotates the state by 2θ towards the marked items,
+    # starting from an angle θ away from the unmarked ones.
+    angle = np.arcsin(np.sqrt(n_marked / 2 ** n_qubits))
+    return np.sin((2 * np.asarray(n_iterations) + 1) * angle) ** 2
+
+class GroverSearch:
+    """
+    Simulates Grover's search over 2^n_qubits items for any of the items
+    in `marked`, following SearchForMarkedItem in operations.qs.
+
+    Every amplitude stays real throughout, so the register is stored as
+    one real number per item. ReflectAboutMarkedState flips the sign of
+    the marked amplitudes, and ReflectAboutInitialState (which is
+    I - 2|+…+⟩⟨+…+|) subtracts twice the mean amplitude from every
+    amplitude. Rather than making a pass over the register for that
+    subtraction, the simulator keeps a running sum of the stored
+    amplitudes and a pending `offset` to be added to all of them, so that
+    both reflections cost time proportional to the number of marked items.
+    The offset is folded back into the register, in a single vectorized
+    pass, whenever all of the amplitudes are needed.
+
+    Unlike the simulators in earlier chapters, this isn't a QuantumDevice:
+    Grover's search only ever needs the two reflections above, and going
+    through per-qubit gates would cost a pass over the whole register for
+    every H, which is what limits those simulators to far fewer qubits.
+    """
+    n_qubits: int
+    marked: np.ndarray
+    rng: np.random.Generator
+
+    def __init__(self, n_qubits: int, marked: Sequence[int],
+                 dtype: np.dtype = np.float64,
+                 rng: Optional[np.random.Generator] = None):
+        self.n_qubits = n_qubits
+        self.marked = np.unique(np.asarray(marked, dtype=np.int64))
+        if len(self.marked) == 0:
+            raise ValueError("At least one item must be marked.")
+        if self.marked[0] < 0 or self.marked[-1] >= 2 ** n_qubits:
+            raise ValueError(
+                f"Marked items must be between 0 and {2 ** n_qubits - 1}."
+            )
+        self.rng = np.random.default_rng(rng)
+        self._amplitudes = np.empty(2 ** n_qubits, dtype=dtype)
+        self.prepare_initial_state()
+
+    @property
+    def n_items(self) -> int:
+        return len(self._amplitudes)
+
+    def prepare_initial_state(self) -> None:
+        self._amplitudes.fill(1 / np.sqrt(self.n_items))
+        self._sum = np.sqrt(self.n_items)
+        self._offset = 0.0
+
+    def reflect_about_marked_state(self) -> None:
+        # -(a + offset) = (-a - 2 offset) + offset, so only the marked
+        # entries of the stored array change.
+        old = self._amplitudes[self.marked].astype(np.float64)
+        new = -old - 2 * self._offset
+        self._amplitudes[self.marked] = new
+        self._sum += float(np.sum(new - old))
+
+    def reflect_about_initial_state(self) -> None:
+        mean = self._sum / self.n_items + self._offset
+        self._offset -= 2 * mean
+
+    @property
+    def success_probability(self) -> float:
+        marked = self._amplitudes[self.marked].astype(np.float64) + self._offset
+        return float(np.sum(marked ** 2))
+
+    @property
+    def amplitudes(self) -> np.ndarray:
+        if self._offset:
+            self._amplitudes += self._offset
+            self._sum += self._offset * self.n_items
+            self._offset = 0.0
+        return self._amplitudes
+
+    def run(self, max_iterations: Optional[int] = None,
+            target: Optional[float] = None) -> np.ndarray:
+        """
+        Applies up to `max_iterations` Grover iterations (by default, as
+        many as NIterations would for this number of marked items), and
+        returns the probability of measuring a marked item before the
+        first iteration and after each one. If `target` is given, stops as
+        soon as that probability reaches it.
+        """
+        if max_iterations is None:
+            max_iterations = n_iterations(self.n_qubits, len(self.marked))
+        probabilities = [self.success_probability]
+        for _ in range(max_iterations):
+            if target is not None and probabilities[-1] >= target:
+                break
+            self.reflect_about_marked_state()
+            self.reflect_about_initial_state()
+            probabilities.append(self.success_probability)
+        return np.array(probabilities)
+
+    def measure(self) -> int:
+        # Finds the item whose range of cumulative probability contains a
+        # uniform random number, one chunk of the register at a time, then
+        # collapses the register onto that item.
+        amplitudes = self.amplitudes
+        remaining = self.rng.random() * float(np.sum(
+            np.square(amplitudes, dtype=np.float64)
+        ))
+        item = self.n_items - 1
+        for start in range(0, self.n_items, CHUNK_SIZE):
+            probabilities = np.square(
+                amplitudes[start:start + CHUNK_SIZE], dtype=np.float64
+            )
+            total = probabilities.sum()
+            if remaining < total:
+                item = start + int(np.searchsorted(
+                    np.cumsum(probabilities), remaining, side="right"
+                ))
+                break
+            remaining -= total
+
+        amplitudes.fill(0)
+        amplitudes[item] = 1
+        self._sum = 1.0
+        return item
+
+class GroverResult(NamedTuple):
+    found: int
+    n_iterations: int
+    success_probabilities: np.ndarray
+
+def search(n_qubits: int, marked: Sequence[int],
+           max_iterations: Optional[int] = None,
+           target: Optional[float] = None,
+           dtype: np.dtype = np.float64,
+           rng: Optional[np.random.Generator] = None) -> GroverResult:
+    engine = GroverSearch(n_qubits, marked, dtype=dtype, rng=rng)
+    probabilities = engine.run(max_iterations, target)
+    return GroverResult(
+        engine.measure(), len(probabilities) - 1, probabilities
+    )
+
+def validate_n_iterations(max_qubits: int = 16, n_marked: int = 1
+    ) -> Dict[int, Tuple[int, int]]:
+    """
+    For each register size, simulates twice as many iterations as
+    NIterations calls for, and returns NIterations next to the number of
+    iterations that actually maximized the probability of success.
+    """
+    results = {}
+    for n_qubits in range(1, max_qubits + 1):
+        if n_marked > 2 ** n_qubits:
+            continue
+        expected = n_iterations(n_qubits, n_marked)
+        engine = GroverSearch(n_qubits, range(n_marked))
+        probabilities = engine.run(2 * expected + 1)
+        # Ties (such as for a single qubit, where every number of
+        # iterations succeeds half of the time) go to the fewest iterations.
+        best = np.flatnonzero(probabilities >= probabilities.max() - 1e-12)[0]
+        results[n_qubits] = (expected, int(best))
+    return results
+
+if __name__ == "__main__":
+    import sys
+
+    for n_qubits, (expected, best) in validate_n_iterations().items():
+        status = "ok" if expected == best else "MISMATCH"
+        print(f"{n_qubits:2d} qubits: NIterations = {expected:3d}, best = {best:3d} ({status})")
+
+    n_qubits = int(sys.argv[1]) if len(sys.argv) > 1 else 24
+    marked = [117, 2 ** n_qubits - 1]
+    start = time.perf_counter()
+    result = search(n_qubits, marked)
+    elapsed = time.perf_counter() - start
+    print(f"Searched {2 ** n_qubits} items for {marked} with {result.n_iterations} iterations " \
+          f"in {elapsed:0.2f} s; found {result.found} " \
+          f"(success probability {result.success_probabilities[-1]:0.6f}).")
@@ -1,19 +1,31 @@
+import argparse
 import numpy as np
 import matplotlib.pyplot as plt
-import random
-import qsharp
-from GroverSearch import RunGroverSearch
+from resource_sweep import grover_stand_in, qsharp_estimator, sweep
 
 if __name__ == "__main__":
-    
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stand-in", action="store_true",
+                        help="Use a local stand-in rather than the Q# resource estimator.")
+    parser.add_argument("--max-workers", type=int, default=None)
+    args = parser.parse_args()
+
+    # A fixed seed picks the same marked items on every run, so that
+    # estimates cached by earlier runs can be reused.
+    rng = np.random.default_rng(2021)
     n_search_items = 2 ** np.arange(4, 25)
     depth = np.empty_like(n_search_items)
 
-    for idx, searchsize in enumerate(n_search_items):
-        estimate = RunGroverSearch.estimate_resources(
-            nItems=int(searchsize), 
-            idxMarkedItem=int(random.randint(0,searchsize-1))
-        )
+    estimates = sweep(
+        "GroverSearch.RunGroverSearch",
+        [
+            {"nItems": int(searchsize), "idxMarkedItem": int(rng.integers(searchsize))}
+            for searchsize in n_search_items
+        ],
+        estimator=grover_stand_in if args.stand_in else qsharp_estimator,
+        max_workers=args.max_workers
+    )
+    for idx, estimate in enumerate(estimates):
         depth[idx] = estimate['Depth']
 
     plt.plot(n_search_items, n_search_items, label='Classical')
@@ -0,0 +1,167 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+##
+# resource_sweep.py: Runs resource estimates for Q# operations over many
+#     sets of arguments in parallel, keeping each result in an on-disk
+#     cache so that sweeps can be resumed and extended without redoing
+#     estimates that have already been made.
+##
+# Copyright (c) Sarah Kaiser and Cassandra Granade.
+# Code sample from the book "Learn Quantum Computing with Python and Q#" by
+# Sarah Kaiser and Cassandra Granade, published by Manning Publications Co.
+# Book ISBN 9781617296130.
+# Code licensed under the MIT License.
+##
+
+import glob
+import hashlib
+import importlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from grover import n_iterations
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CACHE_DIR = os.path.join(SOURCE_DIR, ".resource_cache")
+
+# An estimator takes the fully qualified name of an operation (such as
+# "GroverSearch.RunGroverSearch") and the arguments to call it with, and
+# returns a dictionary of resource counts. It must be defined at the top
+# level of a module so that it can be sent to worker processes.
+Estimator = Callable[[str, Dict[str, Any]], Dict[str, float]]
+
+def qsharp_estimator(operation: str, kwargs: Dict[str, Any]) -> Dict[str, float]:
+    # Importing qsharp starts the IQ# kernel and lets Q# namespaces be
+    # imported as Python modules, so only do so in the process that needs
+    # it.
+    import qsharp
+    namespace, name = operation.rsplit(".", 1)
+    callable_ = getattr(importlib.import_module(namespace), name)
+    return dict(callable_.estimate_resources(**kwargs))
+
+def grover_stand_in(operation: str, kwargs: Dict[str, Any]) -> Dict[str, float]:
+    # A local stand-in for qsharp_estimator, for running sweeps of
+    # RunGroverSearch without Q#. It counts each Grover iteration as a
+    # single step, so it gets the shape of the depth curve right but not
+    # its scale. Like SearchForMarkedItem, it uses BitSizeI(nItems) qubits.
+    n_qubits = int(kwargs["nItems"]).bit_length()
+    iterations = n_iterations(n_qubits)
+    return {"Iterations": iterations, "Depth": iterations}
+
+def _estimator_name(estimator: Estimator) -> str:
+    return f"{estimator.__module__}.{estimator.__qualname__}"
+
+def _jsonable(value: Any) -> Any:
+    # NumPy scalars (such as the elements of np.arange) aren't JSON
+    # serializable themselves, but their Python equivalents are.
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"Can't use {value!r} as an argument to an estimate.")
+
+def sources_hash(source_dir: str = SOURCE_DIR) -> str:
+    # Estimates depend on the Q# code as well as on the arguments, so
+    # editing any of the .qs files should invalidate the cache.
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(source_dir, "*.qs"))):
+        digest.update(os.path.basename(path).encode())
+        with open(path, "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+def cache_key(estimator: Estimator, operation: str,
+              kwargs: Dict[str, Any], sources: Optional[str] = None) -> str:
+    request = json.dumps(
+        {
+            "estimator": _estimator_name(estimator),
+            "operation": operation,
+            "kwargs": kwargs,
+            "sources": sources_hash() if sources is None else sources
+        },
+        sort_keys=True, default=_jsonable
+    )
+    return hashlib.sha256(request.encode()).hexdigest()
+
+class ResultStore:
+    """
+    A content-addressed store of estimates, with one JSON file for each
+    estimate named by the hash of the estimator, operation and arguments
+    that produced it.
+    """
+    root: str
+
+    def __init__(self, root: str = DEFAULT_CACHE_DIR):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def get(self, key: str) -> Optional[Dict[str, float]]:
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)["estimate"]
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, operation: str, kwargs: Dict[str, Any],
+            estimate: Dict[str, float]) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first, so that a sweep killed part way
+        # through never leaves a partial result behind.
+        partial_path = f"{path}.{os.getpid()}.tmp"
+        with open(partial_path, "w") as f:
+            json.dump(
+                {"operation": operation, "kwargs": kwargs, "estimate": estimate},
+                f, default=_jsonable
+            )
+        os.replace(partial_path, path)
+
+def sweep(operation: str, kwargs_list: Sequence[Dict[str, Any]],
+          estimator: Estimator = qsharp_estimator,
+          cache_dir: str = DEFAULT_CACHE_DIR,
+          max_workers: Optional[int] = None) -> List[Dict[str, float]]:
+    """
+    Estimates the resources used by `operation` for each set of arguments
+    in `kwargs_list`, returning the estimates in the same order.
+
+    Estimates already in the cache for the current Q# sources are reused,
+    and the rest are spread across a pool of `max_workers` processes (or
+    run in this process if `max_workers` is 1). Each estimate is saved as
+    soon as it finishes, so an interrupted sweep picks up where it left
+    off when run again.
+    """
+    store = ResultStore(cache_dir)
+    sources = sources_hash()
+    keys = [
+        cache_key(estimator, operation, kwargs, sources)
+        for kwargs in kwargs_list
+    ]
+    estimates = {key: store.get(key) for key in keys}
+    # The same arguments may be asked for more than once, but only need to
+    # be estimated once.
+    missing = {
+        key: kwargs for key, kwargs in zip(keys, kwargs_list)
+        if estimates[key] is None
+    }
+
+    if max_workers == 1:
+        for key, kwargs in missing.items():
+            estimates[key] = estimator(operation, kwargs)
+            store.put(key, operation, kwargs, estimates[key])
+    elif missing:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(estimator, operation, kwargs): key
+                for key, kwargs in missing.items()
+            }
+            for future in as_completed(futures):
+                key = futures[future]
+                estimates[key] = future.result()
+                store.put(key, operation, missing[key], estimates[key])
+
+    return [estimates[key] for key in keys]
@@ -0,0 +1,251 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+##
+# period_finding.py: Simulates the period finding step of Shor's algorithm
+#     (EstimatePeriod in operations.qs) in Python, using the structure of
+#     modular multiplication rather than a general purpose simulator, and
+#     uses it to factor integers as FactorSemiprimeInteger does.
+##
+# Copyright (c) Sarah Kaiser and Cassandra Granade.
+# Code sample from the book "Learn Quantum Computing with Python and Q#" by
+# Sarah Kaiser and Cassandra Granade, published by Manning Publications Co.
+# Book ISBN 9781617296130.
+# Code licensed under the MIT License.
+##
+
+import math
+import time
+from typing import Optional, Tuple
+import numpy as np
+
+from postprocessing import factor_from_frequencies, pow_mod
+
+# Largest number of bits of precision for which the register of powers is
+# kept in full and transformed with an FFT; past this, frequencies are
+# sampled from the closed form of that transform instead.
+MAX_FFT_BITS = 22
+
+# Number of powers of the generator computed at a time when finding its
+# period.
+BLOCK_SIZE = 1 << 16
+
+def modular_multiplication(multiplier: int, modulus: int,
+                           n_bits: int) -> np.ndarray:
+    """
+    Returns MultiplyByModularInteger(multiplier, modulus, _) on an n_bits
+    register as a permutation of its basis states: entry y of the result
+    is the state that |y⟩ is sent to. States at or above the modulus are
+    left alone, as in Q#.
+    """
+    states = np.arange(2 ** n_bits, dtype=np.int64)
+    below = states < modulus
+    states[below] = states[below] * multiplier % modulus
+    return states
+
+class PeriodFinder:
+    """
+    Simulates EstimateFrequency for ApplyPeriodFindingOracle(generator,
+    modulus, _, _), with a register of n_bits_precision control qubits and
+    a work register that starts in |1⟩.
+
+    Every gate in the circuit maps basis states of the work register to
+    basis states, so rather than a state vector over both registers, the
+    simulator tracks which work state goes with each control state: the
+    controlled multiplication by generator^(2^j) is a permutation of work
+    states, applied to the entries whose control bit j is set. Measuring
+    the work register then leaves the control register in an equal
+    superposition of one coset x0 + r ℤ of the period r, and only the
+    number of terms of that coset changes the distribution of frequencies
+    after the QFT. Small registers are transformed with numpy.fft; for
+    larger ones, where the control register can't be held in memory,
+    frequencies are sampled exactly from the known closed form of the
+    transform of a coset.
+    """
+    generator: int
+    modulus: int
+    n_bits_precision: int
+    rng: np.random.Generator
+
+    def __init__(self, generator: int, modulus: int,
+                 n_bits_precision: Optional[int] = None,
+                 rng: Optional[np.random.Generator] = None):
+        if math.gcd(generator, modulus) != 1:
+            raise ValueError("The generator and modulus must be co-prime.")
+        self.generator = generator
+        self.modulus = modulus
+        self.bit_size = int(modulus).bit_length()
+        self.n_bits_precision = (
+            2 * self.bit_size + 1 if n_bits_precision is None
+            else n_bits_precision
+        )
+        self.rng = np.random.default_rng(rng)
+        self._period = None
+
+    def work_register(self) -> np.ndarray:
+        # Entry x is the work state paired with control state |x⟩ after
+        # every controlled multiplication has been applied.
+        if self.n_bits_precision > MAX_FFT_BITS:
+            raise ValueError(
+                f"Can't hold 2^{self.n_bits_precision} control states in memory."
+            )
+        controls = np.arange(2 ** self.n_bits_precision, dtype=np.int64)
+        work = np.ones_like(controls)
+        for bit in range(self.n_bits_precision):
+            permutation = modular_multiplication(
+                int(pow(self.generator, 2 ** bit, self.modulus)),
+                self.modulus, self.bit_size
+            )
+            controlled = (controls >> bit) & 1 == 1
+            work[controlled] = permutation[work[controlled]]
+        return work
+
+    @property
+    def period(self) -> int:
+        # The number of distinct work states, that is, the length of the
+        # orbit of |1⟩ under multiplication by the generator.
+        if self._period is None:
+            step = int(pow(self.generator, BLOCK_SIZE, self.modulus))
+            powers = pow_mod(
+                self.generator, np.arange(BLOCK_SIZE), self.modulus
+            ).astype(np.int64)
+            start = 0
+            while True:
+                ones = np.flatnonzero(powers == 1)
+                ones = ones[ones + start > 0]
+                if len(ones):
+                    self._period = int(start + ones[0])
+                    break
+                powers = powers * step % self.modulus
+                start += BLOCK_SIZE
+        return self._period
+
+    def _coset_sizes(self, shots: int) -> np.ndarray:
+        # Measuring the work register picks x0 uniformly at random; the
+        # coset that remains has one term for each x ≡ x0 (mod r) below
+        # 2^n_bits_precision.
+        n_controls = 2 ** self.n_bits_precision
+        residues = self.rng.integers(n_controls, size=shots) % self.period
+        return n_controls // self.period + (residues < n_controls % self.period)
+
+    def _sample_fft(self, shots: int) -> np.ndarray:
+        work = self.work_register()
+        sizes = self._coset_sizes(shots)
+        frequencies = np.empty(shots, dtype=np.int64)
+        for size in np.unique(sizes):
+            # Any coset with this many terms gives the same distribution,
+            # since shifting a coset only changes the phases of the QFT.
+            residue = 0 if size > len(work) // self.period else self.period - 1
+            coset = (work == work[residue]).astype(complex)
+            amplitudes = np.fft.fft(coset) / np.sqrt(size * len(work))
+            probabilities = np.abs(amplitudes) ** 2
+            chosen = sizes == size
+            frequencies[chosen] = self.rng.choice(
+                len(work), size=np.count_nonzero(chosen),
+                p=probabilities / probabilities.sum()
+            )
+        return frequencies
+
+    def _sample_cosets(self, shots: int) -> np.ndarray:
+        # A coset of size M gives frequency y with probability
+        # F_M(y r / 2^t) / (M 2^t), where F_M(θ) = sin²(πMθ) / sin²(πθ).
+        # Writing r = 2^v r' with r' odd, y r mod 2^t only depends on
+        # z = y r' mod L, with L = 2^(t - v), and each z comes from 2^v
+        # values of y. So z is drawn from F_M(z / L) (by rejection against
+        # an envelope with an analytic inverse CDF), and y recovered from
+        # it by inverting r' mod L.
+        t, period = self.n_bits_precision, self.period
+        v = (period & -period).bit_length() - 1
+        odd_part, n_residues = period >> v, 2 ** (t - v)
+        inverse = pow(odd_part, -1, n_residues)
+
+        sizes = self._coset_sizes(shots).astype(float)
+        residues = np.zeros(shots, dtype=np.int64)
+        pending = np.arange(shots)
+        while len(pending):
+            z, accepted = self._propose(sizes[pending], n_residues)
+            residues[pending[accepted]] = z[accepted]
+            pending = pending[~accepted]
+
+        lifts = self.rng.integers(2 ** v, size=shots)
+        return np.array([
+            (int(z) * inverse) % n_residues + n_residues * int(lift)
+            for z, lift in zip(residues, lifts)
+        ], dtype=object if t > 62 else np.int64)
+
+    def _propose(self, sizes: np.ndarray,
+                 n_residues: int) -> Tuple[np.ndarray, np.ndarray]:
+        # Envelope: e(u) = M² for |u| ≤ b, and L² / (4 (|u| - 1/2)²) out to
+        # |u| = L / 2, which bounds F_M(z / L) for every z = round(u).
+        half = n_residues / 2
+        b = np.minimum(0.5 + n_residues / (2 * sizes), half)
+        center_mass = 2 * b * sizes ** 2
+        tail_mass = n_residues ** 2 / 2 * (1 / (b - 0.5) - 1 / (half - 0.5))
+        tail_mass = np.where(b < half, tail_mass, 0)
+
+        uniform = self.rng.random(len(sizes))
+        in_center = uniform * (center_mass + tail_mass) < center_mass
+        magnitude = np.where(
+            in_center,
+            self.rng.random(len(sizes)) * b,
+            0.5 + 1 / (
+                1 / (b - 0.5) -
+                self.rng.random(len(sizes)) * (1 / (b - 0.5) - 1 / (half - 0.5))
+            )
+        )
+        u = np.where(self.rng.random(len(sizes)) < 0.5, -magnitude, magnitude)
+        envelope = np.where(
+            in_center, sizes ** 2,
+            n_residues ** 2 / (4 * (np.abs(u) - 0.5) ** 2)
+        )
+
+        z = np.round(u)
+        theta = z / n_residues
+        with np.errstate(invalid="ignore", divide="ignore"):
+            fejer = np.where(
+                z == 0, sizes ** 2,
+                np.sin(np.pi * np.fmod(sizes * theta, 1)) ** 2 /
+                np.sin(np.pi * theta) ** 2
+            )
+        accepted = self.rng.random(len(sizes)) * envelope < fejer
+        return z.astype(np.int64) % n_residues, accepted
+
+    def sample_frequencies(self, shots: int = 1) -> np.ndarray:
+        """
+        Returns `shots` independent outcomes of EstimateFrequency, as
+        integers between 0 and 2^n_bits_precision - 1.
+        """
+        if self.n_bits_precision <= MAX_FFT_BITS:
+            return self._sample_fft(shots)
+        return self._sample_cosets(shots)
+
+def factor_semiprime(number: int, shots_per_generator: int = 4,
+                     rng: Optional[np.random.Generator] = None
+    ) -> Tuple[int, int]:
+    """
+    Factors `number` as FactorSemiprimeInteger does, except that each
+    generator gets several frequency samples at once, which are turned
+    into a period and factors together by postprocessing.py.
+    """
+    rng = np.random.default_rng(rng)
+    if number % 2 == 0:
+        return number // 2, 2
+    while True:
+        generator = int(rng.integers(3, number - 1))
+        divisor = math.gcd(generator, number)
+        if divisor != 1:
+            # A lucky guess; no need for period finding.
+            return divisor, number // divisor
+        finder = PeriodFinder(generator, number, rng=rng)
+        factors = factor_from_frequencies(
+            generator, finder.sample_frequencies(shots_per_generator),
+            finder.n_bits_precision, number
+        )
+        if factors is not None:
+            return factors
+
+if __name__ == "__main__":
+    for number in (15, 21, 1009 * 1013, 4093 * 4099):
+        start = time.perf_counter()
+        factors = factor_semiprime(number)
+        elapsed = time.perf_counter() - start
+        print(f"Factored {number} ({int(number).bit_length()} bits) as {factors} in {elapsed:0.2f} s.")
@@ -0,0 +1,185 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+##
+# postprocessing.py: The classical part of Shor's algorithm from
+#     operations.qs (PeriodFromFrequency and MaybeFactorsFromPeriod),
+#     written to work on whole arrays of measured frequencies at once.
+##
+# Copyright (c) Sarah Kaiser and Cassandra Granade.
+# Code sample from the book "Learn Quantum Computing with Python and Q#" by
+# Sarah Kaiser and Cassandra Granade, published by Manning Publications Co.
+# Book ISBN 9781617296130.
+# Code licensed under the MIT License.
+##
+
+from typing import Optional, Tuple
+import numpy as np
+
+# How many distinct denominators to combine in pairs when looking for a
+# period; each pair gives one more candidate to check.
+MAX_PAIRED_DENOMINATORS = 32
+
+def _int_dtype(max_value: int) -> type:
+    # Fixed-width integers are much faster, but products of values up to
+    # max_value need to fit in them; past that, fall back to Python ints.
+    return np.int64 if max_value < 2 ** 62 else object
+
+def pow_mod(base, exponent, modulus: int) -> np.ndarray:
+    """
+    Computes base^exponent mod modulus elementwise (like ExpModI in Q#),
+    by repeated squaring over every element at once.
+    """
+    dtype = _int_dtype(modulus ** 2)
+    base, exponent = np.broadcast_arrays(
+        np.asarray(base, dtype=dtype) % modulus,
+        np.asarray(exponent, dtype=dtype)
+    )
+    base, exponent = base.copy(), exponent.copy()
+    result = np.ones_like(base) % modulus
+    while np.any(exponent > 0):
+        odd = (exponent & 1) == 1
+        result = np.where(odd, result * base % modulus, result)
+        base = base * base % modulus
+        exponent = exponent >> 1
+    return result
+
+def convergent_denominators(frequencies: np.ndarray, n_bits_precision: int,
+                            bound: int) -> np.ndarray:
+    """
+    For each frequency f, returns the denominator of the last continued
+    fraction convergent of f / 2^n_bits_precision whose denominator is at
+    most `bound`, as ContinuedFractionConvergentI does in Q#. All of the
+    expansions are stepped through together, with each one dropping out
+    once it ends or its next denominator would exceed the bound.
+    """
+    dtype = _int_dtype(2 ** n_bits_precision * bound)
+    numerators = np.asarray(frequencies, dtype=dtype).copy()
+    denominators = np.full_like(numerators, 2 ** n_bits_precision)
+    # The denominators of the two previous convergents, starting from
+    # the conventional values of 0 and 1.
+    previous, before_previous = np.zeros_like(numerators), np.ones_like(numerators)
+    result = np.ones_like(numerators)
+    active = np.ones(numerators.shape, dtype=bool)
+
+    while np.any(active):
+        quotient = np.where(active, numerators // denominators, 0)
+        convergent = quotient * previous + before_previous
+        kept = active & (convergent <= bound)
+        result = np.where(kept, convergent, result)
+        remainder = numerators - quotient * denominators
+        active = kept & (remainder != 0)
+        numerators, denominators = (
+            np.where(active, denominators, numerators),
+            np.where(active, remainder, denominators)
+        )
+        previous, before_previous = (
+            np.where(kept, convergent, previous),
+            np.where(kept, previous, before_previous)
+        )
+    return result
+
+def _prime_factors(value: int) -> list:
+    factors, candidate = [], 2
+    while candidate * candidate <= value:
+        if value % candidate == 0:
+            factors.append(candidate)
+            while value % candidate == 0:
+                value //= candidate
+        candidate += 1
+    if value > 1:
+        factors.append(value)
+    return factors
+
+def period_from_frequencies(generator: int, frequencies: np.ndarray,
+                            n_bits_precision: int,
+                            modulus: int) -> Optional[int]:
+    """
+    Finds the period of generator^x mod modulus from many frequency
+    estimates at once, or returns None if none of them lead to it.
+
+    Each frequency gives a denominator that divides the period. As well
+    as the denominators themselves, the running lcm of the denominators
+    (in the order they were measured, as EstimatePeriod would combine
+    them) and the lcm of each pair of distinct denominators are tried as
+    candidates, all checked with a single vectorized modular
+    exponentiation. The smallest candidate that passes is a multiple of
+    the period, and is reduced to the period itself by dividing out prime
+    factors for as long as it still passes.
+    """
+    frequencies = np.asarray(frequencies)
+    frequencies = frequencies[frequencies != 0]
+    if len(frequencies) == 0:
+        return None
+    denominators = convergent_denominators(
+        frequencies, n_bits_precision, modulus
+    ).astype(np.int64)
+
+    distinct = np.unique(denominators)[:MAX_PAIRED_DENOMINATORS]
+    candidates = np.unique(np.concatenate([
+        denominators,
+        np.lcm.accumulate(denominators),
+        np.lcm.outer(distinct, distinct).reshape(-1)
+    ]))
+    # The period divides φ(modulus), so it is always less than the modulus.
+    candidates = candidates[(candidates > 0) & (candidates < modulus)]
+    valid = candidates[pow_mod(generator, candidates, modulus) == 1]
+    if len(valid) == 0:
+        return None
+
+    period = int(valid.min())
+    for prime in _prime_factors(period):
+        while period % prime == 0 and pow_mod(
+            generator, period // prime, modulus
+        ) == 1:
+            period //= prime
+    return period
+
+def factors_from_periods(generators: np.ndarray, periods: np.ndarray,
+                         number: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Applies MaybeFactorsFromPeriod to arrays of generators and their
+    periods, returning which of them found a factor, and the pair of
+    factors found (or (1, 1) where none was).
+
+    Unlike the Q# version, a pair is only counted as found if both of its
+    factors are nontrivial.
+    """
+    generators = np.asarray(generators, dtype=np.int64)
+    periods = np.asarray(periods, dtype=np.int64)
+    half_powers = pow_mod(generators, periods // 2, number).astype(np.int64)
+    factors = np.maximum(
+        np.gcd(half_powers - 1, number), np.gcd(half_powers + 1, number)
+    )
+    found = (
+        (periods % 2 == 0) & (half_powers != number - 1) &
+        (factors > 1) & (factors < number)
+    )
+    factors = np.where(found, factors, 1)
+    return found, np.stack([factors, np.where(found, number // factors, 1)], axis=-1)
+
+def factor_from_frequencies(generator: int, frequencies: np.ndarray,
+                            n_bits_precision: int,
+                            number: int) -> Optional[Tuple[int, int]]:
+    # Turns one batch of measurements for a single generator into a
+    # factorization of number, if they are enough to find one.
+    period = period_from_frequencies(
+        generator, frequencies, n_bits_precision, number
+    )
+    if period is None:
+        return None
+    found, factors = factors_from_periods([generator], [period], number)
+    if not found[0]:
+        return None
+    return int(factors[0, 0]), int(factors[0, 1])
+
+if __name__ == "__main__":
+    # Frequencies that an ideal run of EstimateFrequency might return for
+    # generator 7 and modulus 15, whose period is 4.
+    number, generator = 15, 7
+    n_bits_precision = 2 * int(number).bit_length() + 1
+    frequencies = np.array([0, 128, 256, 384, 129, 383])
+    denominators = convergent_denominators(frequencies, n_bits_precision, number)
+    print(f"Denominators from {frequencies}: {denominators}.")
+    period = period_from_frequencies(generator, frequencies, n_bits_precision, number)
+    print(f"Period of {generator} mod {number}: {period}.")
+    print(f"Factors: {factor_from_frequencies(generator, frequencies, n_bits_precision, number)}.")